@@ -3,11 +3,16 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime
 import warnings
+import hashlib
+import os
+import urllib.error
+import urllib.request
 from io import BytesIO
-import base64
 warnings.filterwarnings('ignore')
+# 开启写时复制（Copy-on-Write）：取子表/选列得到的新对象与原表共享内存，只有真正写入时才按列复制，
+# 因此取子表后不必再防御性地.copy()，也不会误改到缓存中的原始数据
+pd.set_option("mode.copy_on_write", True)
 
 # ---------------------- 页面基础配置 ----------------------
 st.set_page_config(
@@ -18,14 +23,86 @@ st.set_page_config(
 )
 
 
+# ---------------------- 数据源下载与本地缓存 ----------------------
+DATA_URL = "https://github.com/Jane-zzz-123/Logistics/raw/main/Logisticsdata.xlsx"
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_cache")
+
+# 解析时直接指定列类型：低基数的分组列用category，文本列用string（店铺混有纯数字，只能先按string读取）
+SHEET_DTYPES = {
+    "FBA号": "string", "店铺": "string", "仓库": "category", "货代": "category",
+    "异常备注": "string", "提前/延期": "category"
+}
+
+
+@st.cache_resource
+def download_source_file():
+    """下载Excel源文件到本地缓存目录（每个进程只检查一次，远端文件未更新时直接复用本地文件）"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    xlsx_path = os.path.join(CACHE_DIR, "Logisticsdata.xlsx")
+    etag_path = xlsx_path + ".etag"
+
+    # 带上次下载时的ETag做条件请求：远端未变化时返回304，本地Excel（及由它生成的Parquet）保持不变
+    request = urllib.request.Request(DATA_URL)
+    if os.path.exists(xlsx_path) and os.path.exists(etag_path):
+        with open(etag_path, encoding="utf-8") as f:
+            request.add_header("If-None-Match", f.read().strip())
+    try:
+        with urllib.request.urlopen(request) as response:
+            content = response.read()
+            etag = response.headers.get("ETag")
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return xlsx_path
+        raise
+
+    with open(xlsx_path, "wb") as f:
+        f.write(content)
+    if etag:
+        with open(etag_path, "w", encoding="utf-8") as f:
+            f.write(etag)
+    elif os.path.exists(etag_path):
+        os.remove(etag_path)
+    return xlsx_path
+
+
+def sheet_to_parquet(xlsx_path, sheet_name, target_cols, dtypes=None):
+    """将指定sheet转换为Parquet文件（Excel未更新且读取列/类型不变时直接复用已有的Parquet）"""
+    # 文件名带上sheet名、目标列和列类型的签名：部署后目标列或类型有改动时生成新文件，不会读到旧结构的Parquet
+    signature = hashlib.md5(repr((sheet_name, list(target_cols), sorted((dtypes or {}).items()))).encode("utf-8")).hexdigest()[:8]
+    parquet_path = os.path.join(CACHE_DIR, f"{sheet_name}_{signature}.parquet")
+    if not os.path.exists(parquet_path) or os.path.getmtime(parquet_path) < os.path.getmtime(xlsx_path):
+        # calamine引擎解析速度远快于openpyxl；usecols让解析阶段直接跳过无关列
+        df = pd.read_excel(
+            xlsx_path,
+            sheet_name=sheet_name,
+            engine="calamine",
+            usecols=lambda col: col in target_cols,
+            dtype=dtypes
+        )
+        # 按目标列顺序排列（列已在解析阶段裁剪，这里只调整顺序）
+        df = df[[col for col in target_cols if col in df.columns]]
+        # 文本列可能混有数字（如店铺），统一转为字符串后才能写入Parquet
+        for col in df.select_dtypes(include="object").columns:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        df.to_parquet(parquet_path, index=False)
+    return parquet_path
+
+
+def parse_arrival_month(values):
+    """解析到货年月，返回（有效行掩码, YYYY-MM字符串数组, YYYYMM整数数组）"""
+    arrival = pd.to_datetime(values, errors='coerce')
+    valid = arrival.notna().to_numpy()
+    # 年月直接由年、月整数算出，只对去重后的少量月份做字符串格式化，不再逐行strftime
+    month_nums = (arrival.dt.year * 100 + arrival.dt.month).to_numpy()[valid].astype("int32")
+    unique_nums, inverse = np.unique(month_nums, return_inverse=True)
+    unique_labels = np.array([f"{num // 100}-{num % 100:02d}" for num in unique_nums], dtype=object)
+    return valid, unique_labels[inverse], month_nums
+
+
 # ---------------------- 红单数据加载与预处理  ----------------------
 @st.cache_data
 def load_data():
     """读取红单数据并预处理"""
-    # 读取指定sheet
-    url = "https://github.com/Jane-zzz-123/Logistics/raw/main/Logisticsdata.xlsx"
-    df_red = pd.read_excel(url, sheet_name="上架完成-红单")
-
     # 指定需要分析的列
     target_cols = [
         "FBA号", "店铺", "仓库", "货代", "异常备注",
@@ -36,12 +113,15 @@ def load_data():
         "预计物流时效-实际物流时效差值", "提前/延期"
     ]
 
-    # 确保只保留目标列（处理列名可能的空格/大小写问题）
-    df_red = df_red[[col for col in target_cols if col in df_red.columns]]
+    # 读取指定sheet（首次转换为Parquet，之后直接读取Parquet）
+    parquet_path = sheet_to_parquet(download_source_file(), "上架完成-红单", target_cols, SHEET_DTYPES)
+    df_red = pd.read_parquet(parquet_path)
 
     # 数据类型处理
-    df_red["到货年月"] = pd.to_datetime(df_red["到货年月"], errors='coerce').dt.strftime("%Y-%m")
-    df_red = df_red.dropna(subset=["到货年月"])  # 去除到货年月为空的数据
+    valid_month, month_labels, month_nums = parse_arrival_month(df_red["到货年月"])
+    df_red = df_red[valid_month]  # 去除到货年月为空的数据
+    # 到货年月保留字符串（趋势分析中需要对其做大小比较和字符串拼接），改用Arrow字符串存储，分组时按连续缓冲区哈希
+    df_red["到货年月"] = pd.array(month_labels, dtype="string[pyarrow]")
 
     # 数值列处理
     numeric_cols = [
@@ -49,18 +129,41 @@ def load_data():
         "预计物流时效-实际物流时效差值(绝对值)",
         "预计物流时效-实际物流时效差值"
     ]
-    for col in numeric_cols:
+    # 一次性转换为连续的numpy数组处理空值，再整体写回（减少逐列分配；保持float64，均值按两位小数四舍五入时与原先结果一致）
+    present_cols = [col for col in numeric_cols if col in df_red.columns]
+    numeric_arr = df_red[present_cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype="float64", na_value=np.nan)
+    df_red[present_cols] = np.nan_to_num(numeric_arr, copy=False)
+
+    # 低基数文本列统一转为category（仓库/货代/提前/延期在解析时已是category，这里补上其余列）
+    category_cols = ["店铺", "仓库", "货代", "提前/延期", "异常备注"]
+    for col in category_cols:
         if col in df_red.columns:
-            df_red[col] = pd.to_numeric(df_red[col], errors='coerce').fillna(0)
+            # 去掉因删除空到货年月而不再出现的类别，类别列表即为去重后的取值（已按字典序排列）
+            df_red[col] = df_red[col].astype("category").cat.remove_unused_categories()
+    # 其余文本列（如FBA号）唯一值多、不适合category，改用Arrow字符串存储，st.dataframe序列化时直接复用Arrow缓冲区
+    for col in df_red.select_dtypes("string").columns:
+        df_red[col] = df_red[col].astype("string[pyarrow]")
+
+    # 准时标记列（1=提前/准时）加载时只算一次，各处准时率聚合直接取均值
+    df_red["是否准时"] = (df_red["提前/延期"] == "提前/准时").astype("int8")
+
+    # 年月对应的整数（如2025-10 → 202510）已在解析时得到，趋势分析按月份范围筛选时直接做数值比较
 
-    return df_red
+    return df_red, month_nums
+
+
+# 按到货年月预先分组（常驻缓存，直接返回同一份字典，不随每次重跑反序列化），切换月份时按月份取子表，无需再扫描全表
+@st.cache_resource
+def build_month_groups(_df_red):
+    """返回{到货年月: 当月子表}"""
+    return {
+        month: group.reset_index(drop=True)
+        for month, group in _df_red.groupby("到货年月", sort=False, observed=True)
+    }
 # ---------------------- 空派数据加载与预处理 ----------------------
 @st.cache_data
 def load_air_data():
     """读取空派数据并预处理（与红单逻辑完全一致）"""
-    url = "https://github.com/Jane-zzz-123/Logistics/raw/main/Logisticsdata.xlsx"
-    df_air = pd.read_excel(url, sheet_name="上架完成-空派")  # 仅修改sheet名称
-
     target_cols = [
         "FBA号", "店铺", "仓库", "货代", "异常备注",
         "发货-提取", "提取-到港", "到港-签收", "签收-完成上架",
@@ -70,34 +173,68 @@ def load_air_data():
         "预计物流时效-实际物流时效差值", "提前/延期"
     ]
 
-    df_air = df_air[[col for col in target_cols if col in df_air.columns]]
-    df_air["到货年月"] = pd.to_datetime(df_air["到货年月"], errors='coerce').dt.strftime("%Y-%m")
-    df_air = df_air.dropna(subset=["到货年月"])
+    parquet_path = sheet_to_parquet(download_source_file(), "上架完成-空派", target_cols, SHEET_DTYPES)  # 仅修改sheet名称
+    df_air = pd.read_parquet(parquet_path)
+
+    valid_month, month_labels, _ = parse_arrival_month(df_air["到货年月"])
+    df_air = df_air[valid_month]
+    df_air["到货年月"] = month_labels
 
     numeric_cols = [
         "签收-发货时间", "上架完成-发货时间",
         "预计物流时效-实际物流时效差值(绝对值)",
         "预计物流时效-实际物流时效差值"
     ]
-    for col in numeric_cols:
-        if col in df_air.columns:
-            df_air[col] = pd.to_numeric(df_air[col], errors='coerce').fillna(0)
+    # 一次性转换为连续的numpy数组处理空值，再整体写回（减少逐列分配；保持float64，均值按两位小数四舍五入时与原先结果一致）
+    present_cols = [col for col in numeric_cols if col in df_air.columns]
+    numeric_arr = df_air[present_cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype="float64", na_value=np.nan)
+    df_air[present_cols] = np.nan_to_num(numeric_arr, copy=False)
+
+    # 文本列改用Arrow字符串存储（与红单一致）
+    for col in df_air.select_dtypes("string").columns:
+        df_air[col] = df_air[col].astype("string[pyarrow]")
 
     return df_air
 
 # 加载数据
-df_red = load_data()
+df_red, month_nums = load_data()
+month_groups = build_month_groups(df_red)
+
+# 各月数据的列与df_red一致，存在的列只需在加载后计算一次，重跑时直接复用
+COLS = frozenset(df_red.columns)
+DETAIL_COLS = [col for col in [
+    "到货年月", "提前/延期", "FBA号", "店铺", "仓库", "货代",
+    "发货-提取", "提取-到港", "到港-签收", "签收-完成上架",
+    "签收-发货时间", "上架完成-发货时间",
+    "预计物流时效-实际物流时效差值(绝对值)", "预计物流时效-实际物流时效差值"
+] if col in COLS]
+INT_COLS = [col for col in [
+    "发货-提取", "提取-到港", "到港-签收", "签收-完成上架",
+    "签收-发货时间", "上架完成-发货时间"
+] if col in COLS]
+MEAN_COLS = [col for col in [
+    "预计物流时效-实际物流时效差值(绝对值)", "预计物流时效-实际物流时效差值"
+] if col in COLS]
+# 数据源表格显示的列（同样按加载后的列集合过滤，用pd.Index保存，取列时直接按索引对象选择）
+SOURCE_DISPLAY_COLS = pd.Index([col for col in [
+    "到货年月", "FBA号", "店铺", "仓库", "货代", "提前/延期",
+    "异常备注", "发货-提取", "提取-到港", "到港-签收", "签收-完成上架",
+    "发货-签收", "发货-完成上架", "签收-发货时间", "上架完成-发货时间",
+    "预计物流时效-实际物流时效差值(绝对值)", "预计物流时效-实际物流时效差值"
+] if col in COLS])
 
 
 # ---------------------- 工具函数 ----------------------
 def get_prev_month(current_month):
     """获取上个月的年月字符串（格式：YYYY-MM）"""
-    try:
-        current = datetime.strptime(current_month, "%Y-%m")
-        prev_month = current.replace(day=1) - pd.Timedelta(days=1)
-        return prev_month.strftime("%Y-%m")
-    except:
+    # 直接按年月整数推算（1月退到上一年12月），不做日期解析
+    digits = str(current_month).replace("-", "")
+    if len(digits) != 6 or not digits.isdigit():
         return ""
+    year, month = divmod(int(digits), 100)
+    if month == 1:
+        return f"{year - 1}-12"
+    return f"{year}-{month - 1:02d}"
 
 
 def calculate_percent_change(current, prev):
@@ -145,6 +282,813 @@ def highlight_change(val):
     return ""
 
 
+def format_colname(col):
+    """列名换行处理，避免截断"""
+    if len(col) > 8:
+        # 按特殊字符拆分长列名
+        if "-" in col:
+            return col.replace("-", "<br>-")
+        elif "（" in col:
+            return col.replace("（", "<br>（")
+        else:
+            # 手动换行
+            return col[:8] + "<br>" + col[8:]
+    return col
+
+
+def month_to_num(month_str):
+    """年月字符串转换为可比较的整数（如2025-10 → 202510）"""
+    try:
+        return int(month_str.replace("-", ""))
+    except:
+        return 0
+
+
+def format_column_with_diff(main_vals, diff_vals, col_type, is_avg):
+    """趋势表格整列格式化：主值 + 环比箭头（红升绿降），平均值行加粗显示"""
+    main_arr = pd.to_numeric(main_vals, errors="coerce").to_numpy(dtype="float64")
+    diff_arr = pd.to_numeric(diff_vals, errors="coerce").to_numpy(dtype="float64")
+    is_avg = np.asarray(is_avg, dtype=bool)
+
+    if col_type == "rate":
+        avg_str = main_str = np.char.mod("%.2f%%", main_arr * 100)
+        diff_abs_str = np.char.mod("%.2f%%", np.abs(diff_arr) * 100)
+    elif col_type == "num":
+        # 个数列：平均值行保留两位小数，其余行取整
+        avg_str = np.char.mod("%.2f", main_arr)
+        main_str = np.trunc(np.nan_to_num(main_arr)).astype("int64").astype(str)
+        diff_abs_str = np.abs(np.trunc(np.nan_to_num(diff_arr))).astype("int64").astype(str)
+    else:
+        avg_str = main_str = np.char.mod("%.2f", main_arr)
+        diff_abs_str = np.char.mod("%.2f", np.abs(diff_arr))
+
+    arrow = np.where(diff_arr > 0, "↑", "↓")
+    color = np.where(diff_arr > 0, "red", "green")
+    diff_html = np.char.add(np.char.add(np.char.add(np.char.add(np.char.add(
+        '<span style="font-size: 0.7em; color: ', color),
+        ';">\n                        '), arrow), diff_abs_str),
+        "\n                      </span>")
+
+    result = np.where(diff_arr == 0, main_str, np.char.add(np.char.add(main_str, " "), diff_html))
+    return np.where(is_avg, np.char.add(np.char.add("<strong>", avg_str), "</strong>"), result)
+
+
+def convert_to_chinese_month(month_str):
+    """年月转换为中文格式（如2025-10 → 2025年10月）"""
+    try:
+        year, month = month_str.split("-")
+        return f"{year}年{month}月"
+    except:
+        return month_str
+
+
+def category_crosstab(df, row_col, col_col):
+    """统计两个分类列的组合计数（等价于groupby(...).size().unstack(fill_value=0)，只保留出现过的取值）"""
+    row_cat = df[row_col].astype("category").cat
+    col_cat = df[col_col].astype("category").cat
+    row_codes = row_cat.codes.to_numpy()
+    col_codes = col_cat.codes.to_numpy()
+    n_rows, n_cols = len(row_cat.categories), len(col_cat.categories)
+
+    # 空值的编码为-1，先排除；再对组合编码做一次bincount得到二维计数矩阵
+    valid = (row_codes >= 0) & (col_codes >= 0)
+    counts = np.bincount(
+        row_codes[valid].astype("int64") * n_cols + col_codes[valid],
+        minlength=n_rows * n_cols
+    ).reshape(n_rows, n_cols)
+
+    keep_rows = counts.sum(axis=1) > 0
+    keep_cols = counts.sum(axis=0) > 0
+    return pd.DataFrame(
+        counts[keep_rows][:, keep_cols],
+        index=pd.Index(row_cat.categories[keep_rows], name=row_col),
+        columns=pd.Index(col_cat.categories[keep_cols], name=col_col)
+    )
+
+
+def build_text_histogram_html(labels, counts, max_count, color, max_display_length=20):
+    """生成文本直方图HTML（条形长度按比例缩放，整张图一次性渲染）"""
+    counts = np.asarray(counts)
+    bar_lengths = (counts / max_count * max_display_length).astype(int) if max_count > 0 else np.zeros(len(counts), dtype=int)
+    return "".join(
+        f"<div style='font-family: monospace;'><span style='display: inline-block; width: 60px;'>{label}</span>"
+        f"<span style='color: {color};'>{'█' * length}</span> <span> ({count})</span></div>"
+        for label, length, count in zip(labels, bar_lengths, counts)
+    )
+
+def build_metric_cards_html(cards):
+    """生成一行核心指标卡片HTML（flex横向排列，五张卡片一次性渲染）；cards为(标题, 标题颜色, 背景色, 数值, 变化颜色, 变化文本)列表"""
+    cards_html = "".join(
+        f"<div style='flex: 1; background-color: {bg_color}; padding: 15px; border-radius: 8px; text-align: center;'>"
+        f"<h5 style='margin: 0; color: {title_color};'>{title}</h5>"
+        f"<p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{value}</p>"
+        f"<p style='font-size: 14px; color: {change_color}; margin: 0;'>{change_text}</p>"
+        "</div>"
+        for title, title_color, bg_color, value, change_color, change_text in cards
+    )
+    return f"<div style='display: flex; gap: 1rem;'>{cards_html}</div>"
+
+
+
+EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+# 超过该行数的导出改用CSV，序列化速度远快于Excel
+LARGE_EXPORT_ROWS = 50000
+# 数据源表格每页显示的行数（超过时分页，只把当前页的行生成HTML发送到浏览器）
+SOURCE_PAGE_ROWS = 500
+
+
+@st.cache_data
+def df_to_excel_bytes(df, sheet_name):
+    """将DataFrame导出为Excel文件的二进制内容（数据未变化时直接复用缓存，不重复序列化）"""
+    output = BytesIO()
+    # xlsxwriter直接写出xml，比openpyxl先在内存中构建整棵单元格对象树更快、更省内存
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return output.getvalue()
+
+
+@st.cache_data
+def df_to_csv_bytes(df):
+    """将DataFrame导出为CSV文件的二进制内容（utf-8-sig编码，Excel打开中文不乱码）"""
+    return df.to_csv(index=False).encode("utf-8-sig")
+
+
+# ---------------------- 趋势分析列名 ----------------------
+# 全局列名定义（统一管理，避免硬编码错误）
+COL_DELIVERY_MONTH = "到货年月"
+COL_DELAY_STATUS = "提前/延期"
+COL_FBA_NO = "FBA号"
+COL_FREIGHT = "货代"
+COL_WAREHOUSE = "仓库"
+COL_DIFF = "预计物流时效-实际物流时效差值"
+COL_ABS_DIFF = "预计物流时效-实际物流时效差值(绝对值)"
+
+
+# ---------------------- 图表构建（缓存） ----------------------
+# 图表对象用cache_resource缓存：命中时直接返回同一个Figure，不再像cache_data那样每次反序列化重建（st.plotly_chart只读取不修改）
+@st.cache_resource(max_entries=64)
+def build_status_pie(selected_month, status_counts):
+    """生成准时率饼图（status_counts为(状态, 数量)元组）"""
+    names = [name for name, _ in status_counts]
+    values = [count for _, count in status_counts]
+
+    # 确保颜色映射严格生效（显式指定颜色列表），按类别顺序映射颜色
+    color_map = {"提前/准时": "green", "延期": "red"}
+    colors = [color_map.get(name, "gray") for name in names]  # 意外类别显示为灰色
+
+    fig_pie = px.pie(
+        values=values,
+        names=names,
+        title=f"{selected_month} 红单准时率分布",
+        color=names,  # 显式指定颜色依据
+        color_discrete_sequence=colors  # 使用顺序颜色列表确保对应关系
+    )
+    fig_pie.update_layout(height=400)
+    return fig_pie
+
+
+@st.cache_resource(max_entries=64)
+def build_trend_line(chart_data, plot_cols, analysis_dimension, start_month, end_month, avg_row_items):
+    """构建月份趋势折线图（含折点标注与平均值参考线），筛选条件和数据不变时直接复用缓存"""
+    # 列别名
+    abs_diff_col = f"{COL_ABS_DIFF}_均值"
+    diff_col = f"{COL_DIFF}_均值"
+    avg_row = dict(avg_row_items)
+
+    # 构建折线图（按维度分组）
+    # 预先转换为长表（指标名/数值两列），px.line无需在每次重跑时自行melt
+    id_cols = ["到货年月_中文"] + [
+        col for col in [COL_FREIGHT, COL_WAREHOUSE] if col in chart_data.columns
+    ]
+    fig_kwargs = {
+        "data_frame": build_trend_long(chart_data, id_cols, plot_cols),
+        "x": "到货年月_中文",
+        "y": "value",
+        "color": "variable",
+        # 按维度着色时，每个指标仍各自连成一条线
+        "line_group": "variable",
+        "title": f"{convert_to_chinese_month(start_month)} ~ {convert_to_chinese_month(end_month)} {analysis_dimension}核心指标趋势",
+        "labels": {"value": "数值", "variable": "指标", "到货年月_中文": "到货年月"},
+        "markers": True,
+        # 使用WebGL（Scattergl）绘制折线，长时间范围+多维度时不会生成大量SVG节点
+        "render_mode": "webgl",
+        "color_discrete_map": {
+            abs_diff_col: "red",
+            diff_col: "green",
+            "准时率": "blue"
+        },
+        # chart_data已按年月排好序，去重即得月份顺序（维度模式下同一月份有多行）
+        "category_orders": {"到货年月_中文": chart_data["到货年月_中文"].drop_duplicates().tolist()}
+    }
+
+    # 维度分组（货代/仓库）
+    if analysis_dimension == "货代维度" and COL_FREIGHT in chart_data.columns:
+        fig_kwargs["color"] = COL_FREIGHT
+        fig_kwargs["line_dash"] = COL_FREIGHT
+    elif analysis_dimension == "仓库维度" and COL_WAREHOUSE in chart_data.columns:
+        fig_kwargs["color"] = COL_WAREHOUSE
+        fig_kwargs["line_dash"] = COL_WAREHOUSE
+
+    fig_trend = px.line(**fig_kwargs)
+
+    # 折点标注
+    for idx, row in chart_data.iterrows():
+        x_val = row["到货年月_中文"]
+
+        # 维度名称（用于标注区分）
+        dim_name = ""
+        if analysis_dimension == "货代维度" and COL_FREIGHT in row:
+            dim_name = row[COL_FREIGHT]
+        elif analysis_dimension == "仓库维度" and COL_WAREHOUSE in row:
+            dim_name = row[COL_WAREHOUSE]
+
+        # 绝对值差值标注
+        if abs_diff_col in chart_data.columns:
+            y_abs = row[abs_diff_col]
+            fig_trend.add_annotation(
+                x=x_val,
+                y=y_abs,
+                text=f"{dim_name}<br/>{y_abs:.2f}" if dim_name else f"{y_abs:.2f}",
+                showarrow=True,
+                arrowhead=1,
+                ax=0,
+                ay=-20,
+                font={"size": 8, "color": "red"},
+                bgcolor="rgba(255,255,255,0.8)"
+            )
+
+        # 时效差值标注
+        if diff_col in chart_data.columns:
+            y_diff = row[diff_col]
+            fig_trend.add_annotation(
+                x=x_val,
+                y=y_diff,
+                text=f"{dim_name}<br/>{y_diff:.2f}" if dim_name else f"{y_diff:.2f}",
+                showarrow=True,
+                arrowhead=1,
+                ax=0,
+                ay=-40,
+                font={"size": 8, "color": "green"},
+                bgcolor="rgba(255,255,255,0.8)"
+            )
+
+        # 准时率标注
+        if "准时率" in chart_data.columns:
+            y_rate = row["准时率"]
+            fig_trend.add_annotation(
+                x=x_val,
+                y=y_rate,
+                text=f"{dim_name}<br/>{y_rate * 100:.1f}%" if dim_name else f"{y_rate * 100:.1f}%",
+                showarrow=True,
+                arrowhead=1,
+                ax=0,
+                ay=-60,
+                font={"size": 8, "color": "blue"},
+                bgcolor="rgba(255,255,255,0.8)"
+            )
+
+    # 平均值参考线
+    if len(avg_row) > 0:
+        if abs_diff_col in chart_data.columns:
+            avg_abs = float(avg_row.get(abs_diff_col, 0))
+            if avg_abs != 0:
+                fig_trend.add_hline(
+                    y=avg_abs,
+                    line_dash="dash",
+                    line_color="red",
+                    annotation_text=f"绝对值均值: {avg_abs:.2f}",
+                    annotation_position="right"
+                )
+
+        if diff_col in chart_data.columns:
+            avg_diff = float(avg_row.get(diff_col, 0))
+            if avg_diff != 0:
+                fig_trend.add_hline(
+                    y=avg_diff,
+                    line_dash="dash",
+                    line_color="green",
+                    annotation_text=f"时效差值均值: {avg_diff:.2f}",
+                    annotation_position="right"
+                )
+
+        if "准时率" in chart_data.columns:
+            avg_rate = float(avg_row.get("准时率", 0))
+            if avg_rate != 0:
+                fig_trend.add_hline(
+                    y=avg_rate,
+                    line_dash="dash",
+                    line_color="blue",
+                    annotation_text=f"准时率均值: {avg_rate * 100:.1f}%",
+                    annotation_position="right"
+                )
+
+    # 图表样式优化
+    fig_trend.update_layout(
+        height=600,
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+        hovermode="x unified",
+        yaxis=dict(rangemode="normal", fixedrange=False),
+        xaxis=dict(
+            tickangle=45,
+            tickfont={"size": 10},
+            title={"text": "到货年月", "font": {"size": 12}}
+        )
+    )
+
+    return fig_trend
+
+
+@st.cache_data
+def build_trend_long(chart_data, id_cols, value_cols):
+    """趋势折线图数据由宽表转为长表（variable为指标名，value为数值）"""
+    return chart_data.melt(id_vars=id_cols, value_vars=value_cols)
+
+
+@st.cache_resource(max_entries=64)
+def build_status_bar(dim_data, dim_col, selected_month):
+    """生成按维度分组的提前/准时与延期柱状图"""
+    fig_dim = px.bar(
+        dim_data,
+        barmode="group",
+        title=f"{selected_month} {dim_col}准时情况",
+        color_discrete_map={"提前/准时": "green", "延期": "red"}
+    )
+    fig_dim.update_layout(height=400)
+    return fig_dim
+
+
+# 缓存键为（月份, 子表行数）：子表不做全量哈希，只取行数参与缓存键，同一月份行数变化后会重新计算
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: len})
+def compute_core_metrics(df_month, month):
+    """计算某月核心指标（FBA单数、提前/准时数、延期数、两个差值均值）"""
+    if len(df_month) == 0:
+        return 0, 0, 0, 0, 0
+    # 状态计数一次value_counts，两个差值列一次mean
+    status_counts = df_month[COL_DELAY_STATUS].value_counts() if COL_DELAY_STATUS in df_month.columns else pd.Series(dtype="int64")
+    means = df_month[[col for col in (COL_ABS_DIFF, COL_DIFF) if col in df_month.columns]].mean()
+    return (
+        len(df_month),
+        int(status_counts.get("提前/准时", 0)),
+        int(status_counts.get("延期", 0)),
+        means.get(COL_ABS_DIFF, 0),
+        means.get(COL_DIFF, 0)
+    )
+
+
+@st.cache_data(show_spinner=False)
+def build_detail_table(_df_current, selected_month):
+    """生成当月明细表格（平均值行置顶+高亮），返回（html_content, df_table），无数据时返回（None, None）"""
+    abs_col = COL_ABS_DIFF
+    diff_col = COL_DIFF
+
+    # 准备明细数据（存在的列已在加载后计算好）
+    detail_cols = DETAIL_COLS
+    df_detail = _df_current[detail_cols] if len(detail_cols) > 0 else pd.DataFrame()
+    if len(df_detail) == 0:
+        return None, None
+
+    # 按时效差值升序排序
+    if diff_col in df_detail.columns:
+        df_detail = df_detail.sort_values(diff_col, ascending=True)
+
+    # 需要显示为整数的列
+    int_cols = INT_COLS
+
+    # 将整数列整块转换为无小数点格式（空值填充为0）：一次二维转换，不再逐列生成新Series
+    if int_cols:
+        df_detail[int_cols] = (
+            df_detail[int_cols].apply(pd.to_numeric, errors='coerce').fillna(0)
+            .to_numpy(dtype="float64").astype("int32")
+        )
+
+    # 计算平均值行
+    avg_row = {}
+    for col in detail_cols:
+        if col in ["到货年月"]:
+            avg_row[col] = "平均值"
+        elif col in ["提前/延期", "FBA号", "店铺", "仓库", "货代"]:
+            avg_row[col] = "-"
+        elif col in int_cols:
+            # 整数列的平均值保留两位小数
+            avg_val = df_detail[col].mean()
+            avg_row[col] = round(avg_val, 2)
+        else:
+            # 其他数值列保留两位小数
+            avg_val = df_detail[col].mean() if len(df_detail) > 0 else 0
+            avg_row[col] = round(avg_val, 2)
+
+
+    # === 1. 解决列名不完整：长列名换行显示（format_colname） ===
+    # === 2. 生成带固定行的表格（列名完整） ===
+    # 平均值行放在首行，与明细数据拼成一张表（下载也复用这份数据）
+    df_table = pd.concat([pd.DataFrame([avg_row]), df_detail], ignore_index=True)
+
+    # 一次性计算高亮掩码：数值列中大于平均值的单元格
+    num_cols = int_cols + MEAN_COLS
+    avg_arr = np.array([avg_row[col] for col in num_cols], dtype="float64")
+    highlight_mask = df_detail[num_cols].to_numpy(dtype="float64") > avg_arr
+
+    # 按列一次性格式化单元格：整数列的整数值不带小数点（平均值保留两位小数），差值列保留两位小数
+    df_formatted = df_table.astype(str)
+    for col in int_cols:
+        values = df_table[col].to_numpy(dtype="float64")
+        df_formatted[col] = np.where(
+            values == np.round(values),
+            values.astype("int64").astype(str),
+            np.char.mod("%.2f", values)
+        )
+    for col in [abs_col, diff_col]:
+        if col in df_table.columns:
+            df_formatted[col] = np.char.mod("%.2f", df_table[col].to_numpy(dtype="float64"))
+
+    cell_classes = pd.DataFrame("", index=df_table.index, columns=detail_cols)
+    cell_classes.iloc[0] = "avg-cell"
+    cell_classes.loc[1:, num_cols] = np.where(highlight_mask, "highlight", "")
+
+    table_html = (
+        df_formatted.style
+        .set_uuid("red_detail")
+        .hide(axis="index")
+        .format_index(format_colname, axis=1)
+        .set_td_classes(cell_classes)
+        .set_table_attributes('class="data-table"')
+        .to_html()
+    )
+
+    html_content = f"""
+    <style>
+    /* 容器样式 */
+    .table-container {{
+        height: 400px;
+        overflow-y: auto;
+        overflow-x: auto;  /* 横向滚动，避免列名截断 */
+        border: 1px solid #e0e0e0;
+        border-radius: 4px;
+        margin: 10px 0;
+    }}
+
+    /* 核心：单表格 + sticky固定行 */
+    .data-table {{
+        width: 100%;
+        min-width: max-content;  /* 确保列名完整显示 */
+        border-collapse: collapse;
+    }}
+
+    /* 表头固定 + 列名完整显示 */
+    .data-table thead th {{
+        position: sticky;
+        top: 0;
+        background-color: #f8f9fa;
+        font-weight: bold;
+        z-index: 2;
+        padding: 8px 4px;  /* 减小内边距，增加显示空间 */
+        white-space: normal;  /* 允许列名换行 */
+        line-height: 1.2;     /* 行高适配换行 */
+        text-align: center;   /* 列名居中，更易读 */
+    }}
+
+    /* 平均值行固定（紧跟表头） */
+    .data-table td.avg-cell {{
+        position: sticky;
+        top: 60px; /* 适配换行后的表头高度 */
+        background-color: #fff3cd;
+        font-weight: 500;
+        z-index: 1;
+        text-align: center;
+    }}
+
+    /* 通用单元格样式 */
+    .data-table th, .data-table td {{
+        padding: 8px;
+        border: 1px solid #e0e0e0;
+        white-space: nowrap;
+        overflow: hidden;
+        text-overflow: ellipsis;
+    }}
+
+    /* 数据行左对齐 */
+    .data-table tbody tr td {{
+        text-align: left;
+    }}
+
+    /* 高亮样式 */
+    .highlight {{
+        background-color: #ffcccc !important;
+    }}
+    </style>
+
+    <div class="table-container">
+        {table_html}
+    </div>
+    """
+
+    return html_content, df_table
+
+
+# ---------------------- 货代/仓库准时情况分析 ----------------------
+@st.cache_data
+def aggregate_by_dimension(df_filtered, dim_col):
+    """按维度聚合准时情况，返回（维度+准时状态明细表, 维度汇总表），筛选条件不变时直接复用缓存"""
+    # 1. 定义需要计算的差值列
+    abs_diff_col = "预计物流时效-实际物流时效差值(绝对值)"
+    diff_col = "预计物流时效-实际物流时效差值"
+
+    # 2. 核心：只对原始数据做一次最细粒度（维度+「提前/延期」）的分组，汇总表由这张小表再聚合得到
+    # 先按组求和/计数（准时标记列在加载时预先算好，1=提前/准时），均值和准时率最后用和÷数得到
+    # 状态为空的订单不进明细表，但要计入维度汇总，因此分组时保留空值组
+    value_cols = [col for col in [abs_diff_col, diff_col] if col in df_filtered.columns]
+    group_sums = df_filtered.groupby([dim_col, "提前/延期"], observed=True, dropna=False).agg(
+        行数=("是否准时", "size"),
+        订单个数=("FBA号", "count"),
+        准时数=("是否准时", "sum"),
+        **{f"{col}_和": (col, "sum") for col in value_cols},
+        **{f"{col}_数": (col, "count") for col in value_cols}
+    )
+    group_sums = group_sums[group_sums.index.get_level_values(dim_col).notna()]
+
+    # 2.1 基础聚合（维度+准时状态）
+    detail_sums = group_sums[group_sums.index.get_level_values("提前/延期").notna()]
+    dim_detail = pd.DataFrame({
+        "订单个数": detail_sums["订单个数"],  # 新增个数列
+        "准时率": detail_sums["准时数"] / detail_sums["行数"],
+        **{f"{col}_均值": detail_sums[f"{col}_和"] / detail_sums[f"{col}_数"] for col in value_cols}
+    }).reset_index()
+
+    # 2.2 维度汇总聚合（无准时状态维度，用于对比）：在明细小表上按维度合计
+    summary_sums = group_sums.groupby(level=dim_col, observed=True).sum()
+    dim_summary = pd.DataFrame({
+        "总订单个数": summary_sums["订单个数"],
+        "整体准时率": summary_sums["准时数"] / summary_sums["行数"],
+        **{f"{col}_整体均值": summary_sums[f"{col}_和"] / summary_sums[f"{col}_数"] for col in value_cols}
+    }).reset_index()
+
+    # 3. 数值格式化
+    # 百分比格式化整列一次完成（与 f"{x:.2%}" 结果一致），不逐行调用lambda
+    # 差值均值列保留原始精度，显示时由st.dataframe的column_config按两位小数格式化
+    dim_detail["准时率"] = np.char.mod("%.2f%%", dim_detail["准时率"].to_numpy() * 100)
+    dim_summary["整体准时率"] = np.char.mod("%.2f%%", dim_summary["整体准时率"].to_numpy() * 100)
+
+    return dim_detail, dim_summary
+
+
+# 数据来自常驻缓存的load_data（参数加下划线不参与哈希），只按筛选条件做缓存键，切换无关控件时直接复用结果
+@st.cache_data(show_spinner=False)
+def compute_trend(_df_red, _month_nums, start_month, end_month, delay_filter, view_mode,
+                  analysis_dimension, selected_dimension):
+    """月份趋势分析：筛选 → 聚合 → 平均值行 → 环比差值，返回（trend_data, df_with_avg, avg_row, trend_messages）"""
+    # 提示信息不在缓存函数内直接输出（缓存命中时不会重放），以（级别, 文本）列表返回，由调用处显示
+    trend_messages = []
+    # 所有筛选条件合并为一个布尔掩码，只取一次子表（后续只做聚合，不修改子表，无需copy）
+    # 基础月份筛选
+    mask = (_month_nums >= month_to_num(start_month)) & (_month_nums <= month_to_num(end_month))
+
+    # 订单状态筛选
+    if delay_filter == "仅提前/准时":
+        mask &= (_df_red[COL_DELAY_STATUS] == "提前/准时").to_numpy()
+    elif delay_filter == "仅延期":
+        mask &= (_df_red[COL_DELAY_STATUS] == "延期").to_numpy()
+
+    # 适配单选筛选逻辑：仅当选择了具体货代/仓库时才过滤
+    if analysis_dimension == "货代维度" and selected_dimension is not None:
+        mask &= (_df_red[COL_FREIGHT] == selected_dimension).to_numpy()
+    elif analysis_dimension == "仓库维度" and selected_dimension is not None:
+        mask &= (_df_red[COL_WAREHOUSE] == selected_dimension).to_numpy()
+
+    df_trend_filtered = _df_red[mask]
+
+    # 3. 重写数据聚合逻辑（核心修复：分步聚合+手动命名）
+    trend_data = pd.DataFrame()
+    if len(df_trend_filtered) > 0:
+        # 定义分组列
+        group_cols = [COL_DELIVERY_MONTH]
+        if analysis_dimension == "货代维度":
+            group_cols.insert(1, COL_FREIGHT)
+        elif analysis_dimension == "仓库维度":
+            group_cols.insert(1, COL_WAREHOUSE)
+
+        # 明细模式需添加状态列
+        if view_mode == "月份+准时状态（明细）":
+            group_cols.append(COL_DELAY_STATUS)
+
+        try:
+            # ========== 一次分组聚合：订单个数、准时率、差值列均值 ==========
+            # 准时率直接对加载时预先算好的准时标记列取均值，走pandas内置的分组均值
+            agg_spec = {
+                # 有FBA号列时按FBA号计数，否则按行数计数
+                "订单个数": (COL_FBA_NO, "count") if COL_FBA_NO in df_trend_filtered.columns else ("是否准时", "size"),
+                "准时率": ("是否准时", "mean")
+            }
+            # 差值列均值（仅当列存在时）
+            if COL_ABS_DIFF in df_trend_filtered.columns:
+                agg_spec[f"{COL_ABS_DIFF}_均值"] = (COL_ABS_DIFF, "mean")
+            if COL_DIFF in df_trend_filtered.columns:
+                agg_spec[f"{COL_DIFF}_均值"] = (COL_DIFF, "mean")
+            trend_data = df_trend_filtered.groupby(group_cols, observed=True, sort=False).agg(**agg_spec).reset_index()
+            # 聚合结果直接给定数值类型，下游表格和折线图无需再做数值转换（均值保持float64，两位小数四舍五入与原先一致）
+            trend_data = trend_data.astype({
+                "订单个数": "int32",
+                **{col: "float64" for col in agg_spec if col != "订单个数"}
+            })
+
+            # ========== 步骤5：排序 ==========
+            # 分组时不排序（sort=False），只在这里统一排一次
+            # YYYY-MM格式的字符串按字典序排序即为时间顺序，无需再转换为数值
+            trend_data = trend_data.sort_values(group_cols)
+
+        except Exception as e:
+            trend_messages = [
+                ("error", f"数据聚合失败：{str(e)}"),
+                ("write", f"分组列：{group_cols}"),
+                ("write", f"过滤后数据列名：{df_trend_filtered.columns.tolist()}"),
+                ("write", f"聚合结果：{trend_data.head() if len(trend_data) > 0 else '无'}")
+            ]
+    else:
+        trend_messages = [("write", "⚠️ 筛选后无数据")]
+
+    # 4. 计算筛选后整体平均值（适配维度）
+    avg_row = {}
+    df_with_avg = pd.DataFrame()
+    if len(trend_data) > 0:
+        # 定义需要计算均值的列
+        avg_cols = ["订单个数", "准时率"]
+        if f"{COL_ABS_DIFF}_均值" in trend_data.columns:
+            avg_cols.append(f"{COL_ABS_DIFF}_均值")
+        if f"{COL_DIFF}_均值" in trend_data.columns:
+            avg_cols.append(f"{COL_DIFF}_均值")
+
+        # 各列均值一次算出（空值不参与计算，整列为空时记为0）；准时率保留4位小数，其余保留2位
+        means = trend_data[avg_cols].mean().fillna(0)
+
+        # 构建平均值行
+        avg_row = {
+            **{col: "-" for col in trend_data.columns},
+            **{col: round(val, 4 if col == "准时率" else 2) for col, val in means.items()},
+            COL_DELIVERY_MONTH: "筛选后平均值"
+        }
+
+        # 5. 计算环比差值（适配维度）：明细行只排序一次，所有指标列一次性分组求差
+        df_body = trend_data.sort_values(group_cols)
+        # 环比分组列（排除年月）
+        diff_group_cols = [c for c in group_cols if c != COL_DELIVERY_MONTH]
+        if diff_group_cols:
+            df_diffs = df_body.groupby(diff_group_cols, observed=True)[avg_cols].diff()
+        else:
+            df_diffs = df_body[avg_cols].diff()
+        df_diffs = df_diffs.fillna(0).add_suffix("_环比差值")
+
+        # 明细行从1开始编号，平均值行用.loc直接写到第0行，再按行号排到首行
+        df_with_avg = pd.concat([df_body, df_diffs], axis=1)
+        df_with_avg.index = pd.RangeIndex(1, len(df_with_avg) + 1)
+        df_with_avg.loc[0] = avg_row
+        df_with_avg = df_with_avg.sort_index()
+
+    return trend_data, df_with_avg, avg_row, trend_messages
+
+
+# 数据源筛选器的可选值（按数据中首次出现的顺序），数据来自常驻缓存的load_data，只需计算一次
+@st.cache_data(show_spinner=False)
+def source_filter_options(_df_red):
+    """返回仓库/货代/提前延期各列去重后的可选值列表"""
+    return {
+        col: _df_red[col].dropna().unique().tolist()
+        for col in ("仓库", "货代", "提前/延期") if col in _df_red.columns
+    }
+
+
+# 数据源筛选列的倒排索引：每列每个取值对应的行号（升序int32数组），只在首次运行时构建一次
+# 只读的numpy数组用cache_resource常驻，命中时不再反序列化
+@st.cache_resource
+def source_filter_index(_df_red):
+    """返回{列名: {取值: 行号数组}}，筛选时查表取行号，不再逐行比较"""
+    index = {}
+    for col in ("到货年月", "仓库", "货代", "提前/延期"):
+        if col in _df_red.columns:
+            # 一次factorize得到每行的取值编码，稳定排序后按编码切段，每段即为该取值的升序行号
+            codes, uniques = pd.factorize(_df_red[col])
+            order = np.argsort(codes, kind="stable").astype(np.int32)
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            index[col] = {val: order[bounds[i]:bounds[i + 1]] for i, val in enumerate(uniques)}
+    return index
+
+
+# 数据源筛选：同样只按四个筛选值做缓存键，切换其他控件时不再重复查表和取子表
+@st.cache_data(show_spinner=False, max_entries=16)
+def filter_source_data(_df_red, month, warehouse, freight, status):
+    """按到货年月/仓库/货代/提前延期筛选数据源（“全部”表示不筛选），只返回SOURCE_DISPLAY_COLS中的列"""
+    # 只保留实际生效的筛选条件（选“全部”或列不存在的条件不参与筛选）
+    active_filters = {
+        col: val for col, val in [("到货年月", month), ("仓库", warehouse), ("货代", freight), ("提前/延期", status)]
+        if val != "全部" and col in _df_red.columns
+    }
+    # 缓存返回时本身就会生成独立的副本，这里无需再copy
+    if not active_filters:
+        return _df_red[SOURCE_DISPLAY_COLS]
+    # 各条件直接查出行号数组（均已升序去重），从最短的开始依次求交集，无需扫描全表
+    index = source_filter_index(_df_red)
+    row_sets = sorted(
+        (index[col].get(val, np.empty(0, dtype=np.int32)) for col, val in active_filters.items()),
+        key=len
+    )
+    rows = row_sets[0]
+    for other in row_sets[1:]:
+        rows = np.intersect1d(rows, other, assume_unique=True)
+    # 按行号取值，行筛选和列投影一次完成
+    return _df_red.iloc[rows, _df_red.columns.get_indexer(SOURCE_DISPLAY_COLS)]
+
+
+def render_dimension_analysis(df_current, status_filters, dim_col, key_prefix, selected_month):
+    """渲染货代/仓库准时情况分析（柱状图 + 多维度表格 + 下载）"""
+    summary_mode = f"{dim_col}汇总（无状态）"
+    st.markdown(f"### {dim_col}准时情况分析")
+
+    if dim_col in df_current.columns and "提前/延期" in df_current.columns and len(df_current) > 0:
+        col1, col2 = st.columns(2)
+
+        # 左：准时情况柱状图
+        with col1:
+            # 按维度统计提前/准时和延期数量
+            dim_data = category_crosstab(df_current, dim_col, "提前/延期")
+            if "提前/准时" not in dim_data.columns:
+                dim_data["提前/准时"] = 0
+            if "延期" not in dim_data.columns:
+                dim_data["延期"] = 0
+
+            fig_dim = build_status_bar(dim_data, dim_col, selected_month)
+            st.plotly_chart(fig_dim, use_container_width=True)
+
+        # 右：多维度分析表格（实现筛选+个数+差值计算）
+        with col2:
+            # 1. 筛选控件：选择分析维度（全部/仅提前/仅延期）
+            st.markdown("#### 分析维度筛选")
+            delay_filter = st.radio(
+                "选择订单范围",
+                options=["全部订单", "仅提前/准时", "仅延期"],
+                horizontal=True,
+                key=f"{key_prefix}_table_filter"
+            )
+
+            # 2. 根据筛选条件取出预先切分好的数据（只读，不复制）
+            df_filtered = status_filters.get(delay_filter, df_current)
+
+            # 3. 聚合并格式化（缓存结果，仅切换显示模式时不再重复计算）
+            abs_diff_col = "预计物流时效-实际物流时效差值(绝对值)"
+            diff_col = "预计物流时效-实际物流时效差值"
+            dim_detail, dim_summary = aggregate_by_dimension(df_filtered, dim_col)
+
+            # 4. 汇总/明细两张表分别放在标签页中（切换标签在浏览器端完成，不触发重跑）
+            detail_mode = f"{dim_col}+准时状态（明细）"
+            tab_summary, tab_detail = st.tabs([summary_mode, detail_mode])
+
+            # 5. 汇总表格（不加提前/准时/延期维度）
+            with tab_summary:
+                st.dataframe(
+                    dim_summary,
+                    column_config={
+                        dim_col: st.column_config.TextColumn(f"{dim_col}名称"),
+                        "总订单个数": st.column_config.NumberColumn("总订单个数", format="%d"),
+                        "整体准时率": st.column_config.TextColumn("整体准时率"),
+                        f"{abs_diff_col}_整体均值": st.column_config.NumberColumn("绝对值差值整体均值", format="%.2f"),
+                        f"{diff_col}_整体均值": st.column_config.NumberColumn("时效差值整体均值", format="%.2f")
+                    },
+                    use_container_width=True,
+                    height=350
+                )
+
+            # 6. 明细表格（加提前/准时/延期维度）
+            with tab_detail:
+                st.dataframe(
+                    dim_detail,
+                    column_config={
+                        dim_col: st.column_config.TextColumn(f"{dim_col}名称"),
+                        "提前/延期": st.column_config.TextColumn("准时状态"),
+                        "订单个数": st.column_config.NumberColumn("订单个数", format="%d"),
+                        "准时率": st.column_config.TextColumn("准时率"),
+                        f"{abs_diff_col}_均值": st.column_config.NumberColumn("绝对值差值均值", format="%.2f"),
+                        f"{diff_col}_均值": st.column_config.NumberColumn("时效差值均值", format="%.2f")
+                    },
+                    use_container_width=True,
+                    height=350
+                )
+
+            # 7. 下载功能（每个标签页下载各自的表格数据）
+            for tab, view_mode, download_df, key_suffix in [
+                (tab_summary, summary_mode, dim_summary, "summary"),
+                (tab_detail, detail_mode, dim_detail, "detail")
+            ]:
+                with tab:
+                    download_filename = f"{dim_col}分析_{selected_month}_{view_mode.replace('（', '').replace('）', '').replace(' ', '')}.xlsx"
+                    st.download_button(
+                        "📥 下载当前表格数据",
+                        data=df_to_excel_bytes(download_df, f"{dim_col}分析"),
+                        file_name=download_filename,
+                        mime=EXCEL_MIME,
+                        on_click="ignore",
+                        key=f"{key_prefix}_{key_suffix}_download"
+                    )
+    else:
+        st.write(f"⚠️ 暂无{dim_col}准时情况数据")
+
+
 # ---------------------- 红单看板核心逻辑 ----------------------
 def render_red_dashboard(df_red):
     st.title("📦 红单分析看板区域")
@@ -154,7 +1098,9 @@ def render_red_dashboard(df_red):
 st.subheader("🔍 当月红单分析")
 
 # 时间筛选器（到货年月，最新的在最上方）
-month_options = sorted(df_red["到货年月"].unique(), reverse=True) if len(df_red["到货年月"].unique()) > 0 else []
+month_options = sorted(month_groups.keys(), reverse=True)
+# 预先算好每个月对应的上月，切换月份时直接查表
+prev_month_map = {month: get_prev_month(month) for month in month_options}
 selected_month = st.selectbox(
     "选择到货年月",
     options=month_options,
@@ -164,104 +1110,55 @@ selected_month = st.selectbox(
 
 # 筛选当月数据
 if month_options and selected_month:
-    df_current = df_red[df_red["到货年月"] == selected_month].copy()
+    df_current = month_groups[selected_month]
     # 获取上月数据
-    prev_month = get_prev_month(selected_month)
-    df_prev = df_red[
-        df_red["到货年月"] == prev_month].copy() if prev_month and prev_month in month_options else pd.DataFrame()
+    prev_month = prev_month_map.get(selected_month, "")
+    df_prev = month_groups.get(prev_month, pd.DataFrame())
 
     # ---------------------- ① 核心指标卡片 ----------------------
     st.markdown("### 核心指标")
-    # 计算核心指标
+    # 计算核心指标（当月、上月各取一次缓存）
+    current_fba, current_on_time, current_delay, current_abs_avg, current_diff_avg = compute_core_metrics(
+        df_current, selected_month)
+    prev_fba, prev_on_time, prev_delay, prev_abs_avg, prev_diff_avg = compute_core_metrics(
+        df_prev, prev_month)
+
     # 1. FBA单数
-    current_fba = len(df_current)
-    prev_fba = len(df_prev) if not df_prev.empty else 0
     fba_change = current_fba - prev_fba
     fba_change_text = f"{'↑' if fba_change > 0 else '↓' if fba_change < 0 else '—'} {abs(fba_change)} (上月: {prev_fba})"
     fba_change_color = "red" if fba_change > 0 else "green" if fba_change < 0 else "gray"
 
     # 2. 提前/准时数
-    current_on_time = len(
-        df_current[df_current["提前/延期"] == "提前/准时"]) if "提前/延期" in df_current.columns else 0
-    prev_on_time = len(
-        df_prev[df_prev["提前/延期"] == "提前/准时"]) if not df_prev.empty and "提前/延期" in df_prev.columns else 0
     on_time_change = current_on_time - prev_on_time
     on_time_change_text = f"{'↑' if on_time_change > 0 else '↓' if on_time_change < 0 else '—'} {abs(on_time_change)} (上月: {prev_on_time})"
     on_time_change_color = "red" if on_time_change > 0 else "green" if on_time_change < 0 else "gray"
 
     # 3. 延期数
-    current_delay = len(df_current[df_current["提前/延期"] == "延期"]) if "提前/延期" in df_current.columns else 0
-    prev_delay = len(
-        df_prev[df_prev["提前/延期"] == "延期"]) if not df_prev.empty and "提前/延期" in df_prev.columns else 0
     delay_change = current_delay - prev_delay
     delay_change_text = f"{'↑' if delay_change > 0 else '↓' if delay_change < 0 else '—'} {abs(delay_change)} (上月: {prev_delay})"
     delay_change_color = "red" if delay_change > 0 else "green" if delay_change < 0 else "gray"
 
-    # 4. 绝对值差值平均值（将百分比改为差值）
     abs_col = "预计物流时效-实际物流时效差值(绝对值)"
-    current_abs_avg = df_current[abs_col].mean() if abs_col in df_current.columns and len(df_current) > 0 else 0
-    prev_abs_avg = df_prev[abs_col].mean() if not df_prev.empty and abs_col in df_prev.columns and len(
-        df_prev) > 0 else 0
+    diff_col = "预计物流时效-实际物流时效差值"
+
+    # 4. 绝对值差值平均值（将百分比改为差值）
     abs_change = current_abs_avg - prev_abs_avg  # 差值计算（替换百分比）
     abs_change_text = f"{'↑' if abs_change > 0 else '↓' if abs_change < 0 else '—'} {abs(abs_change):.2f} (上月: {prev_abs_avg:.2f})"
     abs_change_color = "red" if abs_change > 0 else "green" if abs_change < 0 else "gray"
 
     # 5. 实际差值平均值
-    diff_col = "预计物流时效-实际物流时效差值"
-    current_diff_avg = df_current[diff_col].mean() if diff_col in df_current.columns and len(df_current) > 0 else 0
-    prev_diff_avg = df_prev[diff_col].mean() if not df_prev.empty and diff_col in df_prev.columns and len(
-        df_prev) > 0 else 0
     diff_change = current_diff_avg - prev_diff_avg
     diff_change_text = f"{'↑' if diff_change > 0 else '↓' if diff_change < 0 else '—'} {abs(diff_change):.2f} (上月: {prev_diff_avg:.2f})"
     diff_change_color = "red" if diff_change > 0 else "green" if diff_change < 0 else "gray"
 
-    # 显示卡片（一行五列）- 改用HTML自定义样式
-    col1, col2, col3, col4, col5 = st.columns(5)
-
-    with col1:
-        st.markdown(f"""
-        <div style='background-color: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center;'>
-            <h5 style='margin: 0; color: #333;'>FBA单</h5>
-            <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_fba}</p>
-            <p style='font-size: 14px; color: {fba_change_color}; margin: 0;'>{fba_change_text}</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-    with col2:
-        st.markdown(f"""
-        <div style='background-color: #f0f8f0; padding: 15px; border-radius: 8px; text-align: center;'>
-            <h5 style='margin: 0; color: green;'>提前/准时数</h5>
-            <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_on_time}</p>
-            <p style='font-size: 14px; color: {on_time_change_color}; margin: 0;'>{on_time_change_text}</p>  <!-- 新增 -->
-        </div>
-        """, unsafe_allow_html=True)
-
-    with col3:
-        st.markdown(f"""
-        <div style='background-color: #fff0f0; padding: 15px; border-radius: 8px; text-align: center;'>
-            <h5 style='margin: 0; color: red;'>延期数</h5>
-            <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_delay}</p>
-            <p style='font-size: 14px; color: {delay_change_color}; margin: 0;'>{delay_change_text}</p>  <!-- 新增 -->
-        </div>
-        """, unsafe_allow_html=True)
-
-    with col4:
-        st.markdown(f"""
-        <div style='background-color: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center;'>
-            <h5 style='margin: 0; color: #333;'>绝对值差值均值</h5>
-            <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_abs_avg:.2f}</p>
-            <p style='font-size: 14px; color: {abs_change_color}; margin: 0;'>{abs_change_text}</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-    with col5:
-        st.markdown(f"""
-        <div style='background-color: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center;'>
-            <h5 style='margin: 0; color: #333;'>实际差值均值</h5>
-            <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_diff_avg:.2f}</p>
-            <p style='font-size: 14px; color: {diff_change_color}; margin: 0;'>{diff_change_text}</p>
-        </div>
-        """, unsafe_allow_html=True)
+    # 显示卡片（一行五列，flex横向排列，一次渲染）- 改用HTML自定义样式
+    st.markdown(build_metric_cards_html([
+        ("FBA单", "#333", "#f8f9fa", current_fba, fba_change_color, fba_change_text),
+        ("提前/准时数", "green", "#f0f8f0", current_on_time, on_time_change_color, on_time_change_text),
+        ("延期数", "red", "#fff0f0", current_delay, delay_change_color, delay_change_text),
+        ("绝对值差值均值", "#333", "#f8f9fa", f"{current_abs_avg:.2f}", abs_change_color, abs_change_text),
+        ("实际差值均值", "#333", "#f8f9fa", f"{current_diff_avg:.2f}", diff_change_color, diff_change_text)
+    ]), unsafe_allow_html=True)
 
     # 生成总结文字
     summary_text = f"""
@@ -288,28 +1185,12 @@ if month_options and selected_month:
     # 左：饼图（提前/准时 vs 延期）
     with col1:
         if "提前/延期" in df_current.columns and len(df_current) > 0:
-            pie_data = df_current["提前/延期"].value_counts()
-
-            # 确保颜色映射严格生效（显式指定颜色列表）
-            # 提取类别并按顺序映射颜色
-            categories = pie_data.index.tolist()
-            colors = []
-            for cat in categories:
-                if cat == "提前/准时":
-                    colors.append("green")
-                elif cat == "延期":
-                    colors.append("red")
-                else:
-                    colors.append("gray")  # 处理意外类别
-
-            fig_pie = px.pie(
-                values=pie_data.values,
-                names=pie_data.index,
-                title=f"{selected_month} 红单准时率分布",
-                color=pie_data.index,  # 显式指定颜色依据
-                color_discrete_sequence=colors  # 使用顺序颜色列表确保对应关系
-            )
-            fig_pie.update_layout(height=400)
+            # 分类列按编码计数；不按数量排序（饼图扇区由Plotly自行排序），去掉未出现状态的0计数
+            pie_data = df_current["提前/延期"].value_counts(sort=False)
+            pie_data = pie_data[pie_data > 0]
+
+            # 以(状态, 数量)元组作为缓存键，月份与计数不变时直接复用已生成的图表
+            fig_pie = build_status_pie(selected_month, tuple(pie_data.items()))
             st.plotly_chart(fig_pie, use_container_width=True)
         else:
             st.write("⚠️ 暂无准时率数据")
@@ -319,15 +1200,12 @@ if month_options and selected_month:
         if diff_col in df_current.columns and len(df_current) > 0:
             # 提取并处理数据
             diff_data = df_current[diff_col].dropna()
-            diff_data = diff_data.round().astype(int)  # 转换为整数天数
+            diff_data = diff_data.round().astype("int16")  # 转换为整数天数
 
-            # 分离提前/准时（>=0）和延期（<0）数据
-            early_data = diff_data[diff_data >= 0]  # 包含0天（准时）
-            delay_data = diff_data[diff_data < 0]  # 延期数据
-
-            # 统计各天数出现次数
-            early_counts = early_data.value_counts().sort_index(ascending=False)  # 从大到小排序
-            delay_counts = delay_data.value_counts().sort_index()  # 从小到大排序（-7, -6...）
+            # 一次统计各天数出现次数，再按天数拆分提前/准时（>=0）和延期（<0），只需扫描数据一遍
+            day_counts = diff_data.value_counts()
+            early_counts = day_counts[day_counts.index >= 0].sort_index(ascending=False)  # 包含0天（准时），从大到小排序
+            delay_counts = day_counts[day_counts.index < 0].sort_index()  # 从小到大排序（-7, -6...）
 
             # 计算最大计数（用于归一化显示长度）
             max_count = max(
@@ -339,31 +1217,23 @@ if month_options and selected_month:
             # 生成文本直方图（使用HTML设置颜色，与饼图保持一致）
             st.markdown("#### 提前/准时区间分布")
             if not early_counts.empty:
-                for day, count in early_counts.items():
-                    # 计算显示长度（按比例缩放）
-                    display_length = int((count / max_count) * max_display_length) if max_count > 0 else 0
-                    bar = "█" * display_length
-                    day_label = f"+{day}天" if day > 0 else "0天"  # 0天特殊处理
-                    # 绿色显示（与饼图提前/准时颜色一致）
-                    st.markdown(
-                        f"<div style='font-family: monospace;'><span style='display: inline-block; width: 60px;'>{day_label}</span>"
-                        f"<span style='color: green;'>{bar}</span> <span> ({count})</span></div>",
-                        unsafe_allow_html=True
-                    )
+                day_labels = [f"+{day}天" if day > 0 else "0天" for day in early_counts.index]  # 0天特殊处理
+                # 绿色显示（与饼图提前/准时颜色一致）
+                st.markdown(
+                    build_text_histogram_html(day_labels, early_counts, max_count, "green", max_display_length),
+                    unsafe_allow_html=True
+                )
             else:
                 st.text("暂无提前/准时数据")
 
             st.markdown("#### 延迟区间分布")
             if not delay_counts.empty:
-                for day, count in delay_counts.items():
-                    display_length = int((count / max_count) * max_display_length) if max_count > 0 else 0
-                    bar = "█" * display_length
-                    # 红色显示（与饼图延期颜色一致）
-                    st.markdown(
-                        f"<div style='font-family: monospace;'><span style='display: inline-block; width: 60px;'>{day}天</span>"
-                        f"<span style='color: red;'>{bar}</span> <span> ({count})</span></div>",
-                        unsafe_allow_html=True
-                    )
+                day_labels = [f"{day}天" for day in delay_counts.index]
+                # 红色显示（与饼图延期颜色一致）
+                st.markdown(
+                    build_text_histogram_html(day_labels, delay_counts, max_count, "red", max_display_length),
+                    unsafe_allow_html=True
+                )
             else:
                 st.text("暂无延迟数据")
         else:
@@ -374,216 +1244,21 @@ if month_options and selected_month:
     # ---------------------- ③ 当月红单明细表格 ----------------------
     st.markdown("### 红单明细（含平均值）")
 
-    # 准备明细数据
-    detail_cols = [
-        "到货年月", "提前/延期", "FBA号", "店铺", "仓库", "货代",
-        # 新增的物流阶段列（加在货代右边）
-        "发货-提取", "提取-到港", "到港-签收", "签收-完成上架",
-        "签收-发货时间", "上架完成-发货时间",
-        abs_col, diff_col
-    ]
-    # 过滤存在的列
-    detail_cols = [col for col in detail_cols if col in df_current.columns]
-    df_detail = df_current[detail_cols].copy() if len(detail_cols) > 0 else pd.DataFrame()
-
-    if len(df_detail) > 0:
-        # 按时效差值升序排序
-        if diff_col in df_detail.columns:
-            df_detail = df_detail.sort_values(diff_col, ascending=True)
-
-        # 定义需要显示为整数的列
-        int_cols = [
-            "发货-提取", "提取-到港", "到港-签收", "签收-完成上架",
-            "签收-发货时间", "上架完成-发货时间"
-        ]
-        # 过滤存在的整数列
-        int_cols = [col for col in int_cols if col in df_detail.columns]
-
-        # 将整数列转换为无小数点格式（空值填充为0）
-        for col in int_cols:
-            df_detail[col] = pd.to_numeric(df_detail[col], errors='coerce').fillna(0).astype(int)
-
-        # 计算平均值行
-        avg_row = {}
-        for col in detail_cols:
-            if col in ["到货年月"]:
-                avg_row[col] = "平均值"
-            elif col in ["提前/延期", "FBA号", "店铺", "仓库", "货代"]:
-                avg_row[col] = "-"
-            elif col in int_cols:
-                # 整数列的平均值保留两位小数
-                avg_val = df_detail[col].mean()
-                avg_row[col] = round(avg_val, 2)
-            else:
-                # 其他数值列保留两位小数
-                avg_val = df_detail[col].mean() if len(df_detail) > 0 else 0
-                avg_row[col] = round(avg_val, 2)
-
-
-        # 格式化函数
-        def format_value(val, col):
-            """格式化单元格值"""
-            try:
-                if val == "平均值" or val == "-":
-                    return val
-                if col in int_cols:
-                    if isinstance(val, (int, float)):
-                        if val == int(val):
-                            return f"{int(val)}"
-                        else:
-                            return f"{val:.2f}"
-                elif col in [abs_col, diff_col]:
-                    return f"{val:.2f}"
-                return str(val)
-            except:
-                return str(val)
-
-
-        # === 1. 解决列名不完整：换行/自适应宽度 ===
-        # 处理长列名（换行显示）
-        def format_colname(col):
-            """列名换行处理，避免截断"""
-            if len(col) > 8:
-                # 按特殊字符拆分长列名
-                if "-" in col:
-                    return col.replace("-", "<br>-")
-                elif "（" in col:
-                    return col.replace("（", "<br>（")
-                else:
-                    # 手动换行
-                    return col[:8] + "<br>" + col[8:]
-            return col
-
-
-        # === 2. 生成带固定行的表格（列名完整） ===
-        html_content = f"""
-        <style>
-        /* 容器样式 */
-        .table-container {{
-            height: 400px;
-            overflow-y: auto;
-            overflow-x: auto;  /* 横向滚动，避免列名截断 */
-            border: 1px solid #e0e0e0;
-            border-radius: 4px;
-            margin: 10px 0;
-        }}
-
-        /* 核心：单表格 + sticky固定行 */
-        .data-table {{
-            width: 100%;
-            min-width: max-content;  /* 确保列名完整显示 */
-            border-collapse: collapse;
-        }}
-
-        /* 表头固定 + 列名完整显示 */
-        .data-table thead th {{
-            position: sticky;
-            top: 0;
-            background-color: #f8f9fa;
-            font-weight: bold;
-            z-index: 2;
-            padding: 8px 4px;  /* 减小内边距，增加显示空间 */
-            white-space: normal;  /* 允许列名换行 */
-            line-height: 1.2;     /* 行高适配换行 */
-            text-align: center;   /* 列名居中，更易读 */
-        }}
-
-        /* 平均值行固定（紧跟表头） */
-        .avg-row td {{
-            position: sticky;
-            top: 60px; /* 适配换行后的表头高度 */
-            background-color: #fff3cd;
-            font-weight: 500;
-            z-index: 1;
-            text-align: center;
-        }}
-
-        /* 通用单元格样式 */
-        .data-table th, .data-table td {{
-            padding: 8px;
-            border: 1px solid #e0e0e0;
-            white-space: nowrap;
-            overflow: hidden;
-            text-overflow: ellipsis;
-        }}
-
-        /* 数据行左对齐 */
-        .data-table tbody tr td {{
-            text-align: left;
-        }}
-
-        /* 高亮样式 */
-        .highlight {{
-            background-color: #ffcccc !important;
-        }}
-        </style>
-
-        <div class="table-container">
-            <table class="data-table">
-                <!-- 表头（列名换行处理） -->
-                <thead>
-                    <tr>
-                        {''.join([f'<th>{format_colname(col)}</th>' for col in detail_cols])}
-                    </tr>
-                </thead>
-                <tbody>
-                    <!-- 平均值行 -->
-                    <tr class="avg-row">
-                        {''.join([f'<td>{format_value(avg_row[col], col)}</td>' for col in detail_cols])}
-                    </tr>
-                    <!-- 数据行 -->
-                    {''.join([
-            '<tr>' + ''.join([
-                f'<td class={"highlight" if (
-                        col in (int_cols + [abs_col, diff_col])
-                        and avg_row[col] not in ["-", "平均值"]
-                        and pd.notna(row[col])
-                        and float(row[col]) > float(avg_row[col])
-                ) else ""}>{format_value(row[col], col)}</td>'
-                for col in detail_cols
-            ]) + '</tr>'
-            for _, row in df_detail.iterrows()
-        ])}
-                </tbody>
-            </table>
-        </div>
-        """
+    # 明细表格只取决于所选月份，切换其他控件时直接复用缓存的HTML
+    html_content, df_table = build_detail_table(df_current, selected_month)
 
+    if html_content is not None:
         # 渲染表格
         st.markdown(html_content, unsafe_allow_html=True)
 
-        # === 3. 添加表格下载功能 ===
-        import pandas as pd
-        from io import BytesIO
-        import base64
-
-        # 构建带平均值的完整数据（用于下载）
-        df_download = pd.concat([pd.DataFrame([avg_row]), df_detail], ignore_index=True)
-
-
-        # 定义下载函数
-        def get_table_download_link(df, filename, text):
-            """生成表格下载链接"""
-            # 保存为Excel（保留格式）
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='红单明细')
-            output.seek(0)
-            b64 = base64.b64encode(output.read()).decode()
-
-            # 生成下载链接
-            href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">{text}</a>'
-            return href
-
-
-        # 显示下载按钮
-        st.markdown(
-            get_table_download_link(
-                df_download,
-                f"红单明细_{selected_month}.xlsx",
-                "📥 下载红单明细表格（Excel格式）"
-            ),
-            unsafe_allow_html=True
+        # === 3. 添加表格下载功能（带平均值的完整数据） ===
+        st.download_button(
+            "📥 下载红单明细表格（Excel格式）",
+            data=df_to_excel_bytes(df_table, "红单明细"),
+            file_name=f"红单明细_{selected_month}.xlsx",
+            mime=EXCEL_MIME,
+            on_click="ignore",
+            key="red_detail_download"
         )
 
     else:
@@ -591,323 +1266,30 @@ if month_options and selected_month:
 
     st.divider()
 
-    # ---------------------- ④ 当月货代准时情况 ----------------------
-    st.markdown("### 货代准时情况分析")
-
-    if "货代" in df_current.columns and "提前/延期" in df_current.columns and len(df_current) > 0:
-        col1, col2 = st.columns(2)
-
-        # 左：货代准时情况柱状图（保留原有逻辑）
-        with col1:
-            # 按货代统计提前/准时和延期数量
-            freight_data = df_current.groupby(["货代", "提前/延期"]).size().unstack(fill_value=0)
-            if "提前/准时" not in freight_data.columns:
-                freight_data["提前/准时"] = 0
-            if "延期" not in freight_data.columns:
-                freight_data["延期"] = 0
-
-            fig_freight = px.bar(
-                freight_data,
-                barmode="group",
-                title=f"{selected_month} 货代准时情况",
-                color_discrete_map={"提前/准时": "green", "延期": "red"}
-            )
-            fig_freight.update_layout(height=400)
-            st.plotly_chart(fig_freight, use_container_width=True)
-
-        # 右：货代多维度分析表格（实现筛选+个数+差值计算）
-        with col2:
-            # 1. 筛选控件：选择分析维度（全部/仅提前/仅延期）
-            st.markdown("#### 分析维度筛选")
-            delay_filter = st.radio(
-                "选择订单范围",
-                options=["全部订单", "仅提前/准时", "仅延期"],
-                horizontal=True,
-                key="freight_table_filter"
-            )
-
-            # 2. 根据筛选条件过滤数据
-            if delay_filter == "仅提前/准时":
-                df_filtered = df_current[df_current["提前/延期"] == "提前/准时"].copy()
-            elif delay_filter == "仅延期":
-                df_filtered = df_current[df_current["提前/延期"] == "延期"].copy()
-            else:
-                df_filtered = df_current.copy()
-
-            # 3. 定义需要计算的差值列
-            abs_diff_col = "预计物流时效-实际物流时效差值(绝对值)"
-            diff_col = "预计物流时效-实际物流时效差值"
-
-            # 4. 核心：双层聚合（支持「货代」+「提前/延期」维度）
-            # 4.1 基础聚合（货代+准时状态）
-            freight_detail = df_filtered.groupby(["货代", "提前/延期"]).agg(
-                订单个数=("FBA号", "count"),  # 新增个数列
-                准时率=("提前/延期", lambda x: (x == "提前/准时").sum() / len(x) if len(x) > 0 else 0),
-                **{
-                    f"{abs_diff_col}_均值": (abs_diff_col, "mean") if abs_diff_col in df_filtered.columns else 0,
-                    f"{diff_col}_均值": (diff_col, "mean") if diff_col in df_filtered.columns else 0
-                }
-            ).reset_index()
-
-            # 4.2 货代汇总聚合（无准时状态维度，用于对比）
-            freight_summary = df_filtered.groupby("货代").agg(
-                总订单个数=("FBA号", "count"),
-                整体准时率=("提前/延期", lambda x: (x == "提前/准时").sum() / len(x) if len(x) > 0 else 0),
-                **{
-                    f"{abs_diff_col}_整体均值": (abs_diff_col, "mean") if abs_diff_col in df_filtered.columns else 0,
-                    f"{diff_col}_整体均值": (diff_col, "mean") if diff_col in df_filtered.columns else 0
-                }
-            ).reset_index()
-
-            # 5. 数值格式化
-            # 5.1 明细表格格式化
-            freight_detail["准时率"] = freight_detail["准时率"].apply(lambda x: f"{x:.2%}")
-            if abs_diff_col in freight_detail.columns:
-                freight_detail[f"{abs_diff_col}_均值"] = freight_detail[f"{abs_diff_col}_均值"].round(2)
-            if diff_col in freight_detail.columns:
-                freight_detail[f"{diff_col}_均值"] = freight_detail[f"{diff_col}_均值"].round(2)
-
-            # 5.2 汇总表格格式化
-            freight_summary["整体准时率"] = freight_summary["整体准时率"].apply(lambda x: f"{x:.2%}")
-            if abs_diff_col in freight_summary.columns:
-                freight_summary[f"{abs_diff_col}_整体均值"] = freight_summary[f"{abs_diff_col}_整体均值"].round(2)
-            if diff_col in freight_summary.columns:
-                freight_summary[f"{diff_col}_整体均值"] = freight_summary[f"{diff_col}_整体均值"].round(2)
-
-            # 6. 切换显示模式（汇总/明细）
-            view_mode = st.radio(
-                "表格显示模式",
-                options=["货代汇总（无状态）", "货代+准时状态（明细）"],
-                horizontal=True,
-                key="freight_view_mode"
-            )
-
-            # 7. 显示对应表格
-            st.markdown(f"#### {view_mode}")
-            if view_mode == "货代汇总（无状态）":
-                # 汇总表格（不加提前/准时/延期维度）
-                st.dataframe(
-                    freight_summary,
-                    column_config={
-                        "货代": st.column_config.TextColumn("货代名称"),
-                        "总订单个数": st.column_config.NumberColumn("总订单个数", format="%d"),
-                        "整体准时率": st.column_config.TextColumn("整体准时率"),
-                        f"{abs_diff_col}_整体均值": st.column_config.NumberColumn("绝对值差值整体均值", format="%.2f"),
-                        f"{diff_col}_整体均值": st.column_config.NumberColumn("时效差值整体均值", format="%.2f")
-                    },
-                    use_container_width=True,
-                    height=350
-                )
-            else:
-                # 明细表格（加提前/准时/延期维度）
-                st.dataframe(
-                    freight_detail,
-                    column_config={
-                        "货代": st.column_config.TextColumn("货代名称"),
-                        "提前/延期": st.column_config.TextColumn("准时状态"),
-                        "订单个数": st.column_config.NumberColumn("订单个数", format="%d"),
-                        "准时率": st.column_config.TextColumn("准时率"),
-                        f"{abs_diff_col}_均值": st.column_config.NumberColumn("绝对值差值均值", format="%.2f"),
-                        f"{diff_col}_均值": st.column_config.NumberColumn("时效差值均值", format="%.2f")
-                    },
-                    use_container_width=True,
-                    height=350
-                )
-
-            # 8. 下载功能
-            import pandas as pd
-            from io import BytesIO
-            import base64
-
+    # 按准时状态预先切分当月数据（货代、仓库分析共用，只读视图，不复制数据）
+    status_filters = {"全部订单": df_current}
+    if "提前/延期" in df_current.columns:
+        status_filters["仅提前/准时"] = df_current[df_current["提前/延期"] == "提前/准时"]
+        status_filters["仅延期"] = df_current[df_current["提前/延期"] == "延期"]
 
-            def generate_download_link(df, filename, link_text):
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df.to_excel(writer, index=False, sheet_name='货代分析')
-                output.seek(0)
-                b64 = base64.b64encode(output.read()).decode()
-                return f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">{link_text}</a>'
-
-
-            # 下载当前显示的表格数据
-            download_df = freight_summary if view_mode == "货代汇总（无状态）" else freight_detail
-            download_filename = f"货代分析_{selected_month}_{view_mode.replace('（', '').replace('）', '').replace(' ', '')}.xlsx"
-            st.markdown(
-                generate_download_link(download_df, download_filename, "📥 下载当前表格数据"),
-                unsafe_allow_html=True
-            )
-    else:
-        st.write("⚠️ 暂无货代准时情况数据")
+    # ---------------------- ④ 当月货代准时情况 ----------------------
+    render_dimension_analysis(df_current, status_filters, "货代", "freight", selected_month)
 
     st.divider()
 
     # ---------------------- ⑤ 当月仓库准时情况 ----------------------
-    st.markdown("### 仓库准时情况分析")
-
-    if "仓库" in df_current.columns and "提前/延期" in df_current.columns and len(df_current) > 0:
-        col1, col2 = st.columns(2)
-
-        # 左：仓库准时情况柱状图（复用货代图表逻辑，替换为仓库维度）
-        with col1:
-            # 按仓库统计提前/准时和延期数量
-            warehouse_data = df_current.groupby(["仓库", "提前/延期"]).size().unstack(fill_value=0)
-            if "提前/准时" not in warehouse_data.columns:
-                warehouse_data["提前/准时"] = 0
-            if "延期" not in warehouse_data.columns:
-                warehouse_data["延期"] = 0
-
-            fig_warehouse = px.bar(
-                warehouse_data,
-                barmode="group",
-                title=f"{selected_month} 仓库准时情况",
-                color_discrete_map={"提前/准时": "green", "延期": "red"}
-            )
-            fig_warehouse.update_layout(height=400)
-            st.plotly_chart(fig_warehouse, use_container_width=True)
-
-        # 右：仓库多维度分析表格（完全复用货代表格逻辑，替换为仓库维度）
-        with col2:
-            # 1. 筛选控件：选择分析维度（全部/仅提前/仅延期）
-            st.markdown("#### 分析维度筛选")
-            delay_filter = st.radio(
-                "选择订单范围",
-                options=["全部订单", "仅提前/准时", "仅延期"],
-                horizontal=True,
-                key="warehouse_table_filter"
-            )
-
-            # 2. 根据筛选条件过滤数据
-            if delay_filter == "仅提前/准时":
-                df_filtered = df_current[df_current["提前/延期"] == "提前/准时"].copy()
-            elif delay_filter == "仅延期":
-                df_filtered = df_current[df_current["提前/延期"] == "延期"].copy()
-            else:
-                df_filtered = df_current.copy()
-
-            # 3. 定义需要计算的差值列
-            abs_diff_col = "预计物流时效-实际物流时效差值(绝对值)"
-            diff_col = "预计物流时效-实际物流时效差值"
-
-            # 4. 核心：双层聚合（支持「仓库」+「提前/延期」维度）
-            # 4.1 基础聚合（仓库+准时状态）
-            warehouse_detail = df_filtered.groupby(["仓库", "提前/延期"]).agg(
-                订单个数=("FBA号", "count"),  # 新增个数列
-                准时率=("提前/延期", lambda x: (x == "提前/准时").sum() / len(x) if len(x) > 0 else 0),
-                **{
-                    f"{abs_diff_col}_均值": (abs_diff_col, "mean") if abs_diff_col in df_filtered.columns else 0,
-                    f"{diff_col}_均值": (diff_col, "mean") if diff_col in df_filtered.columns else 0
-                }
-            ).reset_index()
-
-            # 4.2 仓库汇总聚合（无准时状态维度，用于对比）
-            warehouse_summary = df_filtered.groupby("仓库").agg(
-                总订单个数=("FBA号", "count"),
-                整体准时率=("提前/延期", lambda x: (x == "提前/准时").sum() / len(x) if len(x) > 0 else 0),
-                **{
-                    f"{abs_diff_col}_整体均值": (abs_diff_col, "mean") if abs_diff_col in df_filtered.columns else 0,
-                    f"{diff_col}_整体均值": (diff_col, "mean") if diff_col in df_filtered.columns else 0
-                }
-            ).reset_index()
-
-            # 5. 数值格式化
-            # 5.1 明细表格格式化
-            warehouse_detail["准时率"] = warehouse_detail["准时率"].apply(lambda x: f"{x:.2%}")
-            if abs_diff_col in warehouse_detail.columns:
-                warehouse_detail[f"{abs_diff_col}_均值"] = warehouse_detail[f"{abs_diff_col}_均值"].round(2)
-            if diff_col in warehouse_detail.columns:
-                warehouse_detail[f"{diff_col}_均值"] = warehouse_detail[f"{diff_col}_均值"].round(2)
-
-            # 5.2 汇总表格格式化
-            warehouse_summary["整体准时率"] = warehouse_summary["整体准时率"].apply(lambda x: f"{x:.2%}")
-            if abs_diff_col in warehouse_summary.columns:
-                warehouse_summary[f"{abs_diff_col}_整体均值"] = warehouse_summary[f"{abs_diff_col}_整体均值"].round(2)
-            if diff_col in warehouse_summary.columns:
-                warehouse_summary[f"{diff_col}_整体均值"] = warehouse_summary[f"{diff_col}_整体均值"].round(2)
-
-            # 6. 切换显示模式（汇总/明细）
-            view_mode = st.radio(
-                "表格显示模式",
-                options=["仓库汇总（无状态）", "仓库+准时状态（明细）"],
-                horizontal=True,
-                key="warehouse_view_mode"
-            )
-
-            # 7. 显示对应表格
-            st.markdown(f"#### {view_mode}")
-            if view_mode == "仓库汇总（无状态）":
-                # 汇总表格（不加提前/准时/延期维度）
-                st.dataframe(
-                    warehouse_summary,
-                    column_config={
-                        "仓库": st.column_config.TextColumn("仓库名称"),
-                        "总订单个数": st.column_config.NumberColumn("总订单个数", format="%d"),
-                        "整体准时率": st.column_config.TextColumn("整体准时率"),
-                        f"{abs_diff_col}_整体均值": st.column_config.NumberColumn("绝对值差值整体均值", format="%.2f"),
-                        f"{diff_col}_整体均值": st.column_config.NumberColumn("时效差值整体均值", format="%.2f")
-                    },
-                    use_container_width=True,
-                    height=350
-                )
-            else:
-                # 明细表格（加提前/准时/延期维度）
-                st.dataframe(
-                    warehouse_detail,
-                    column_config={
-                        "仓库": st.column_config.TextColumn("仓库名称"),
-                        "提前/延期": st.column_config.TextColumn("准时状态"),
-                        "订单个数": st.column_config.NumberColumn("订单个数", format="%d"),
-                        "准时率": st.column_config.TextColumn("准时率"),
-                        f"{abs_diff_col}_均值": st.column_config.NumberColumn("绝对值差值均值", format="%.2f"),
-                        f"{diff_col}_均值": st.column_config.NumberColumn("时效差值均值", format="%.2f")
-                    },
-                    use_container_width=True,
-                    height=350
-                )
-
-            # 8. 下载功能
-            import pandas as pd
-            from io import BytesIO
-            import base64
-
-
-            def generate_download_link(df, filename, link_text):
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df.to_excel(writer, index=False, sheet_name='仓库分析')
-                output.seek(0)
-                b64 = base64.b64encode(output.read()).decode()
-                return f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">{link_text}</a>'
-
-
-            # 下载当前显示的表格数据
-            download_df = warehouse_summary if view_mode == "仓库汇总（无状态）" else warehouse_detail
-            download_filename = f"仓库分析_{selected_month}_{view_mode.replace('（', '').replace('）', '').replace(' ', '')}.xlsx"
-            st.markdown(
-                generate_download_link(download_df, download_filename, "📥 下载当前表格数据"),
-                unsafe_allow_html=True
-            )
-    else:
-        st.write("⚠️ 暂无仓库准时情况数据")
+    render_dimension_analysis(df_current, status_filters, "仓库", "warehouse", selected_month)
 
     st.divider()
 
     # ====================== 不同月份红单趋势分析（货代+仓库维度细分） ======================
     st.markdown("### 不同月份红单趋势分析（货代/仓库维度）")
 
-    # 全局列名定义（统一管理，避免硬编码错误）
-    COL_DELIVERY_MONTH = "到货年月"
-    COL_DELAY_STATUS = "提前/延期"
-    COL_FBA_NO = "FBA号"
-    COL_FREIGHT = "货代"
-    COL_WAREHOUSE = "仓库"
-    COL_DIFF = "预计物流时效-实际物流时效差值"
-    COL_ABS_DIFF = "预计物流时效-实际物流时效差值(绝对值)"
-
     # 基础数据校验
     if isinstance(df_red, pd.DataFrame) and len(df_red) > 0:
         # 检查核心列是否存在
         required_core_cols = [COL_DELIVERY_MONTH, COL_DELAY_STATUS]
-        missing_core_cols = [col for col in required_core_cols if col not in df_red.columns]
+        missing_core_cols = [col for col in required_core_cols if col not in COLS]
         if missing_core_cols:
             st.error(f"⚠️ 缺少核心列：{missing_core_cols}，无法进行趋势分析")
         else:
@@ -934,7 +1316,8 @@ if month_options and selected_month:
             with col1:
                 # 1. 基础筛选控件
                 st.markdown("#### 分析条件设置")
-                all_months_trend = sorted(df_red[COL_DELIVERY_MONTH].dropna().unique())
+                # 月份列表直接复用当月分析中按月分组得到的键（升序）
+                all_months_trend = month_options[::-1]
 
                 # 月份范围选择
                 if len(all_months_trend) >= 2:
@@ -968,18 +1351,10 @@ if month_options and selected_month:
                     key="trend_delay_filter"
                 )
 
-                # 显示模式
-                view_mode = st.radio(
-                    "表格显示模式",
-                    options=["月份汇总（无状态）", "月份+准时状态（明细）"],
-                    horizontal=True,
-                    key="trend_view_mode"
-                )
-
                 # 核心修改：货代/仓库改为「全部+单选」筛选
                 selected_dimension = None
                 if analysis_dimension == "货代维度":
-                    all_freight = sorted(df_red[COL_FREIGHT].dropna().unique())
+                    all_freight = df_red[COL_FREIGHT].cat.categories.tolist()
                     # 插入「全部」选项到第一个位置
                     freight_options = ["全部"] + all_freight
                     selected_freight = st.selectbox(
@@ -990,7 +1365,7 @@ if month_options and selected_month:
                     )
                     selected_dimension = selected_freight if selected_freight != "全部" else None
                 elif analysis_dimension == "仓库维度":
-                    all_warehouse = sorted(df_red[COL_WAREHOUSE].dropna().unique())
+                    all_warehouse = df_red[COL_WAREHOUSE].cat.categories.tolist()
                     # 插入「全部」选项到第一个位置
                     warehouse_options = ["全部"] + all_warehouse
                     selected_warehouse = st.selectbox(
@@ -1001,358 +1376,127 @@ if month_options and selected_month:
                     )
                     selected_dimension = selected_warehouse if selected_warehouse != "全部" else None
 
-                # 2. 数据过滤（适配单选+全部筛选逻辑）
+                # 2~5. 数据过滤、聚合、平均值行与环比差值（按筛选条件缓存）
                 if start_month and end_month:
-                    # 月份转换函数
-                    def month_to_num(month_str):
-                        try:
-                            return int(month_str.replace("-", ""))
-                        except:
-                            return 0
-
-
-                    # 基础月份筛选
-                    df_trend_filtered = df_red[
-                        (df_red[COL_DELIVERY_MONTH].apply(month_to_num) >= month_to_num(start_month)) &
-                        (df_red[COL_DELIVERY_MONTH].apply(month_to_num) <= month_to_num(end_month))
-                        ].copy()
-
-                    # 订单状态筛选
-                    if delay_filter == "仅提前/准时":
-                        df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_DELAY_STATUS] == "提前/准时"].copy()
-                    elif delay_filter == "仅延期":
-                        df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_DELAY_STATUS] == "延期"].copy()
-
-                    # 适配单选筛选逻辑：仅当选择了具体货代/仓库时才过滤
-                    if analysis_dimension == "货代维度" and selected_dimension is not None:
-                        df_trend_filtered = df_trend_filtered[
-                            df_trend_filtered[COL_FREIGHT] == selected_dimension].copy()
-                    elif analysis_dimension == "仓库维度" and selected_dimension is not None:
-                        df_trend_filtered = df_trend_filtered[
-                            df_trend_filtered[COL_WAREHOUSE] == selected_dimension].copy()
-
-                    # 3. 重写数据聚合逻辑（核心修复：分步聚合+手动命名）
-                    trend_data = pd.DataFrame()
-                    if len(df_trend_filtered) > 0:
-                        # 定义分组列
-                        group_cols = [COL_DELIVERY_MONTH]
-                        if analysis_dimension == "货代维度":
-                            group_cols.insert(1, COL_FREIGHT)
-                        elif analysis_dimension == "仓库维度":
-                            group_cols.insert(1, COL_WAREHOUSE)
-
-                        # 明细模式需添加状态列
-                        if view_mode == "月份+准时状态（明细）":
-                            group_cols.append(COL_DELAY_STATUS)
-
-                        try:
-                            # ========== 步骤1：计算订单个数 ==========
-                            if COL_FBA_NO in df_trend_filtered.columns:
-                                df_count = df_trend_filtered.groupby(group_cols)[COL_FBA_NO].count().reset_index()
-                                df_count.rename(columns={COL_FBA_NO: "订单个数"}, inplace=True)
-                            else:
-                                # 备选：按行数计数
-                                df_count = df_trend_filtered.groupby(group_cols).size().reset_index(name="订单个数")
-
-                            # ========== 步骤2：计算准时率 ==========
-                            # 先计算每组的准时订单数和总订单数
-                            df_delay = df_trend_filtered.copy()
-                            df_delay["是否准时"] = df_delay[COL_DELAY_STATUS] == "提前/准时"
-                            df_rate = df_delay.groupby(group_cols).agg({
-                                "是否准时": ["sum", "count"]
-                            }).reset_index()
-                            df_rate.columns = group_cols + ["准时订单数", "总订单数"]
-                            # 计算准时率（避免除零）
-                            df_rate["准时率"] = df_rate["准时订单数"] / df_rate["总订单数"].replace(0, 1)
-                            # 只保留分组列和准时率
-                            df_rate = df_rate[group_cols + ["准时率"]]
-
-                            # ========== 步骤3：计算差值列均值（仅当列存在时） ==========
-                            df_diff = pd.DataFrame()
-                            if COL_ABS_DIFF in df_trend_filtered.columns or COL_DIFF in df_trend_filtered.columns:
-                                agg_diff_dict = {}
-                                if COL_ABS_DIFF in df_trend_filtered.columns:
-                                    agg_diff_dict[COL_ABS_DIFF] = "mean"
-                                if COL_DIFF in df_trend_filtered.columns:
-                                    agg_diff_dict[COL_DIFF] = "mean"
-
-                                if agg_diff_dict:
-                                    df_diff = df_trend_filtered.groupby(group_cols).agg(agg_diff_dict).reset_index()
-                                    # 重命名差值列
-                                    if COL_ABS_DIFF in df_diff.columns:
-                                        df_diff.rename(columns={COL_ABS_DIFF: f"{COL_ABS_DIFF}_均值"}, inplace=True)
-                                    if COL_DIFF in df_diff.columns:
-                                        df_diff.rename(columns={COL_DIFF: f"{COL_DIFF}_均值"}, inplace=True)
-
-                            # ========== 步骤4：合并所有指标 ==========
-                            # 先合并个数和准时率
-                            trend_data = pd.merge(df_count, df_rate, on=group_cols, how="inner")
-                            # 再合并差值列（如果有）
-                            if not df_diff.empty:
-                                trend_data = pd.merge(trend_data, df_diff, on=group_cols, how="left")
-
-                            # ========== 步骤5：排序 ==========
-                            trend_data["年月数值"] = trend_data[COL_DELIVERY_MONTH].apply(month_to_num)
-                            sort_cols = ["年月数值"] + [col for col in group_cols if col != COL_DELIVERY_MONTH]
-                            trend_data = trend_data.sort_values(sort_cols).drop("年月数值", axis=1)
-
-                        except Exception as e:
-                            st.error(f"数据聚合失败：{str(e)}")
-                            st.write(f"分组列：{group_cols}")
-                            st.write(f"过滤后数据列名：{df_trend_filtered.columns.tolist()}")
-                            st.write(f"订单个数数据：{df_count.head() if 'df_count' in locals() else '无'}")
-                    else:
-                        st.write("⚠️ 筛选后无数据")
-
-                    # 4. 计算筛选后整体平均值（适配维度）
-                    avg_row = {}
-                    df_with_avg = pd.DataFrame()
-                    if len(trend_data) > 0:
-                        # 定义需要计算均值的列
-                        avg_cols = ["订单个数", "准时率"]
-                        if f"{COL_ABS_DIFF}_均值" in trend_data.columns:
-                            avg_cols.append(f"{COL_ABS_DIFF}_均值")
-                        if f"{COL_DIFF}_均值" in trend_data.columns:
-                            avg_cols.append(f"{COL_DIFF}_均值")
-
-                        # 构建平均值行
-                        avg_row = {col: "-" for col in trend_data.columns}
-                        avg_row[COL_DELIVERY_MONTH] = "筛选后平均值"
-
-                        # 计算各列均值
-                        for col in avg_cols:
-                            valid_vals = trend_data[col].dropna()
-                            if len(valid_vals) > 0:
-                                if col == "订单个数":
-                                    avg_row[col] = round(valid_vals.mean(), 2)
-                                elif col == "准时率":
-                                    avg_row[col] = round(valid_vals.mean(), 4)
-                                else:
-                                    avg_row[col] = round(valid_vals.mean(), 2)
-                            else:
-                                avg_row[col] = 0
-
-                        # 插入平均值行
-                        df_with_avg = pd.concat([pd.DataFrame([avg_row]), trend_data], ignore_index=True)
-
-
-                        # 5. 计算环比差值（适配维度 + 列存在性校验）
-                        def calculate_monthly_diff(df, base_col, group_cols=[COL_DELIVERY_MONTH]):
-                            df_data = df.iloc[1:].copy() if len(df) > 1 else df.copy()
-                            if len(df_data) == 0 or base_col not in df_data.columns:
-                                return df
-
-                            # 按维度分组计算环比
-                            df_data["年月数值"] = df_data[COL_DELIVERY_MONTH].apply(month_to_num)
-                            sort_cols = ["年月数值"] + [c for c in group_cols if c not in [COL_DELIVERY_MONTH]]
-                            df_data = df_data.sort_values(sort_cols)
-
-                            # 环比分组列（排除年月）
-                            diff_group_cols = [c for c in group_cols if c not in [COL_DELIVERY_MONTH]]
-                            if diff_group_cols and all(col in df_data.columns for col in diff_group_cols):
-                                df_data[f"{base_col}_环比差值"] = df_data.groupby(diff_group_cols)[base_col].diff()
-                            else:
-                                df_data[f"{base_col}_环比差值"] = df_data[base_col].diff()
-
-                            df_data[f"{base_col}_环比差值"] = df_data[f"{base_col}_环比差值"].fillna(0)
-
-                            if len(df) > 1:
-                                df_result = pd.concat([df.iloc[0:1], df_data], ignore_index=True)
-                            else:
-                                df_result = df_data
-                            return df_result.drop("年月数值", axis=1)
-
-
-                        # 计算核心列环比（仅处理存在的列）
-                        for col in avg_cols:
-                            if col in df_with_avg.columns:
-                                df_with_avg = calculate_monthly_diff(df_with_avg, col, group_cols)
-
-
-                        # 6. 格式化显示（适配维度）
-                        def format_value_with_diff(main_val, diff_val, col_type, is_avg=False):
-                            if is_avg:
-                                if col_type == "num":
-                                    return f"<strong>{main_val:.2f}</strong>"
-                                elif col_type == "rate":
-                                    return f"<strong>{main_val:.2%}</strong>"
-                                elif col_type == "diff":
-                                    return f"<strong>{main_val:.2f}</strong>"
-                                else:
-                                    return f"<strong>{main_val}</strong>"
-
-                            try:
-                                if col_type == "num":
-                                    main_str = f"{int(main_val)}"
-                                elif col_type == "rate":
-                                    main_str = f"{main_val:.2%}"
-                                elif col_type == "diff":
-                                    main_str = f"{main_val:.2f}"
-                                else:
-                                    main_str = str(main_val)
-                            except:
-                                main_str = "0"
-
-                            if diff_val == 0:
-                                diff_str = ""
-                            else:
-                                arrow = "↑" if diff_val > 0 else "↓"
-                                color = "red" if diff_val > 0 else "green"
-                                try:
-                                    if col_type == "num":
-                                        diff_val_str = f"{abs(int(diff_val))}"
-                                    elif col_type == "rate":
-                                        diff_val_str = f"{abs(diff_val):.2%}"
-                                    elif col_type == "diff":
-                                        diff_val_str = f"{abs(diff_val):.2f}"
-                                    else:
-                                        diff_val_str = f"{abs(diff_val)}"
-                                except:
-                                    diff_val_str = "0"
-
-                                diff_str = f"""<span style="font-size: 0.7em; color: {color};">
-                                                {arrow}{diff_val_str}
-                                              </span>"""
-
-                            return f"{main_str} {diff_str}" if diff_str else main_str
-
-
-                        # 7. 生成显示数据
-                        trend_display = df_with_avg.copy()
-                        trend_display["is_avg"] = trend_display[COL_DELIVERY_MONTH] == "筛选后平均值"
-
-                        # 格式化各列（仅处理存在的列）
-                        if "订单个数" in trend_display.columns and "订单个数_环比差值" in trend_display.columns:
-                            trend_display["订单个数"] = trend_display.apply(
-                                lambda x: format_value_with_diff(x["订单个数"], x["订单个数_环比差值"], "num",
-                                                                 x["is_avg"]),
-                                axis=1
+                    # 汇总/明细两张表分别放在标签页中（切换标签在浏览器端完成，不触发重跑）
+                    trend_view_modes = ["月份汇总（无状态）", "月份+准时状态（明细）"]
+                    for trend_tab, view_mode in zip(st.tabs(trend_view_modes), trend_view_modes):
+                        with trend_tab:
+                            trend_data, df_with_avg, avg_row, trend_messages = compute_trend(
+                                df_red, month_nums, start_month, end_month, delay_filter, view_mode,
+                                analysis_dimension, selected_dimension
                             )
-                            trend_display = trend_display.drop(["订单个数_环比差值", "is_avg"], axis=1)
+                            for level, text in trend_messages:
+                                (st.error if level == "error" else st.write)(text)
+                            if view_mode == trend_view_modes[0]:
+                                trend_summary_result = (trend_data, df_with_avg, avg_row)
+                            if len(trend_data) > 0:
+                                # 6. 格式化显示（适配维度，使用format_column_with_diff）
+                                # 7. 生成显示数据
+                                trend_display = df_with_avg.copy()
+                                trend_display["is_avg"] = trend_display[COL_DELIVERY_MONTH] == "筛选后平均值"
+                                is_avg = trend_display["is_avg"].to_numpy()
+
+                                # 格式化各列（仅处理存在的列，整列一次完成，不逐行apply）
+                                abs_diff_mean_col = f"{COL_ABS_DIFF}_均值"
+                                diff_mean_col = f"{COL_DIFF}_均值"
+                                for col, col_type in [("订单个数", "num"), ("准时率", "rate"),
+                                                      (abs_diff_mean_col, "diff"), (diff_mean_col, "diff")]:
+                                    if col in trend_display.columns and f"{col}_环比差值" in trend_display.columns:
+                                        trend_display[col] = format_column_with_diff(
+                                            trend_display[col], trend_display[f"{col}_环比差值"], col_type, is_avg
+                                        )
+                                        trend_display = trend_display.drop(f"{col}_环比差值", axis=1)
+                                trend_display = trend_display.drop("is_avg", axis=1)
+
+                                # 8. 生成HTML表格
+                                st.markdown(f"#### 月份趋势分析（{analysis_dimension}）{start_month} ~ {end_month}")
+                                # 补充筛选条件显示
+                                if analysis_dimension == "货代维度" and selected_dimension:
+                                    st.markdown(f"**当前筛选：{selected_dimension}**")
+                                elif analysis_dimension == "仓库维度" and selected_dimension:
+                                    st.markdown(f"**当前筛选：{selected_dimension}**")
+
+                                html_style = """
+                                <style>
+                                .trend-table-container {
+                                    height: 400px;
+                                    overflow-y: auto;
+                                    border: 1px solid #e0e0e0;
+                                    border-radius: 4px;
+                                    margin: 10px 0;
+                                }
+                                .trend-table {
+                                    width: 100%;
+                                    border-collapse: collapse;
+                                }
+                                .trend-table th {
+                                    position: sticky;
+                                    top: 0;
+                                    background-color: #f8f9fa;
+                                    font-weight: bold;
+                                    z-index: 2;
+                                    padding: 8px;
+                                    border: 1px solid #e0e0e0;
+                                }
+                                .avg-row td {
+                                    position: sticky;
+                                    top: 38px;
+                                    background-color: #fff3cd;
+                                    font-weight: bold;
+                                    z-index: 1;
+                                    padding: 8px;
+                                    border: 1px solid #e0e0e0;
+                                }
+                                .trend-table td {
+                                    padding: 8px;
+                                    border: 1px solid #e0e0e0;
+                                }
+                                </style>
+                                """
+
+                                headers = [col for col in trend_display.columns if col != "is_avg"]
+                                header_html = "".join([f"<th>{col}</th>" for col in headers])
+
+                                # 一次取出所有单元格值，整表用join拼接（首行为平均值行），不逐行构造Series
+                                rows_html = "".join(
+                                    ("<tr class='avg-row'>" if idx == 0 else "<tr>")
+                                    + "".join(f"<td>{val}</td>" for val in row)
+                                    + "</tr>"
+                                    for idx, row in enumerate(trend_display[headers].to_numpy(dtype=object))
+                                )
 
-                        if "准时率" in trend_display.columns and "准时率_环比差值" in trend_display.columns:
-                            trend_display["准时率"] = trend_display.apply(
-                                lambda x: format_value_with_diff(x["准时率"], x["准时率_环比差值"], "rate",
-                                                                 x[COL_DELIVERY_MONTH] == "筛选后平均值"),
-                                axis=1
-                            )
-                            trend_display = trend_display.drop("准时率_环比差值", axis=1)
-
-                        abs_diff_mean_col = f"{COL_ABS_DIFF}_均值"
-                        if abs_diff_mean_col in trend_display.columns and f"{abs_diff_mean_col}_环比差值" in trend_display.columns:
-                            trend_display[abs_diff_mean_col] = trend_display.apply(
-                                lambda x: format_value_with_diff(x[abs_diff_mean_col],
-                                                                 x[f"{abs_diff_mean_col}_环比差值"],
-                                                                 "diff", x[COL_DELIVERY_MONTH] == "筛选后平均值"),
-                                axis=1
-                            )
-                            trend_display = trend_display.drop(f"{abs_diff_mean_col}_环比差值", axis=1)
-
-                        diff_mean_col = f"{COL_DIFF}_均值"
-                        if diff_mean_col in trend_display.columns and f"{diff_mean_col}_环比差值" in trend_display.columns:
-                            trend_display[diff_mean_col] = trend_display.apply(
-                                lambda x: format_value_with_diff(x[diff_mean_col], x[f"{diff_mean_col}_环比差值"],
-                                                                 "diff",
-                                                                 x[COL_DELIVERY_MONTH] == "筛选后平均值"),
-                                axis=1
-                            )
-                            trend_display = trend_display.drop(f"{diff_mean_col}_环比差值", axis=1)
-
-                        # 8. 生成HTML表格
-                        st.markdown(f"#### 月份趋势分析（{analysis_dimension}）{start_month} ~ {end_month}")
-                        # 补充筛选条件显示
-                        if analysis_dimension == "货代维度" and selected_dimension:
-                            st.markdown(f"**当前筛选：{selected_dimension}**")
-                        elif analysis_dimension == "仓库维度" and selected_dimension:
-                            st.markdown(f"**当前筛选：{selected_dimension}**")
-
-                        html_style = """
-                        <style>
-                        .trend-table-container {
-                            height: 400px;
-                            overflow-y: auto;
-                            border: 1px solid #e0e0e0;
-                            border-radius: 4px;
-                            margin: 10px 0;
-                        }
-                        .trend-table {
-                            width: 100%;
-                            border-collapse: collapse;
-                        }
-                        .trend-table th {
-                            position: sticky;
-                            top: 0;
-                            background-color: #f8f9fa;
-                            font-weight: bold;
-                            z-index: 2;
-                            padding: 8px;
-                            border: 1px solid #e0e0e0;
-                        }
-                        .avg-row td {
-                            position: sticky;
-                            top: 38px;
-                            background-color: #fff3cd;
-                            font-weight: bold;
-                            z-index: 1;
-                            padding: 8px;
-                            border: 1px solid #e0e0e0;
-                        }
-                        .trend-table td {
-                            padding: 8px;
-                            border: 1px solid #e0e0e0;
-                        }
-                        </style>
-                        """
-
-                        headers = [col for col in trend_display.columns if col != "is_avg"]
-                        header_html = "".join([f"<th>{col}</th>" for col in headers])
-
-                        rows_html = ""
-                        for idx, row in trend_display.iterrows():
-                            if idx == 0:
-                                row_html = "<tr class='avg-row'>"
-                                for col in headers:
-                                    row_html += f"<td>{row[col]}</td>"
-                                row_html += "</tr>"
+                                table_html = f"""
+                                {html_style}
+                                <div class='trend-table-container'>
+                                    <table class='trend-table'>
+                                        <thead><tr>{header_html}</tr></thead>
+                                        <tbody>{rows_html}</tbody>
+                                    </table>
+                                </div>
+                                """
+
+                                st.markdown(table_html, unsafe_allow_html=True)
+
+
+                                # 9. 下载功能（文件名补充筛选条件）
+                                download_suffix = f"_{selected_dimension}" if selected_dimension else ""
+                                mode_suffix = "" if view_mode == "月份汇总（无状态）" else "_明细"
+                                download_filename = f"{analysis_dimension}_月份红单趋势{mode_suffix}{download_suffix}_{start_month}_{end_month}.xlsx"
+                                st.download_button(
+                                    "📥 下载趋势数据（含平均值）",
+                                    data=df_to_excel_bytes(df_with_avg, f"{analysis_dimension}趋势"),
+                                    file_name=download_filename,
+                                    mime=EXCEL_MIME,
+                                    on_click="ignore",
+                                    key="trend_download" if view_mode == "月份汇总（无状态）" else "trend_detail_download"
+                                )
                             else:
-                                row_html = "<tr>"
-                                for col in headers:
-                                    row_html += f"<td>{row[col]}</td>"
-                                row_html += "</tr>"
-                            rows_html += row_html
-
-                        table_html = f"""
-                        {html_style}
-                        <div class='trend-table-container'>
-                            <table class='trend-table'>
-                                <thead><tr>{header_html}</tr></thead>
-                                <tbody>{rows_html}</tbody>
-                            </table>
-                        </div>
-                        """
-
-                        st.markdown(table_html, unsafe_allow_html=True)
-
-
-                        # 9. 下载功能
-                        def generate_trend_download_link(df, filename, link_text):
-                            output = BytesIO()
-                            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                                df.to_excel(writer, index=False, sheet_name=f'{analysis_dimension}趋势')
-                            output.seek(0)
-                            b64 = base64.b64encode(output.read()).decode()
-                            return f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">{link_text}</a>'
-
-
-                        # 下载文件名补充筛选条件
-                        download_suffix = f"_{selected_dimension}" if selected_dimension else ""
-                        download_filename = f"{analysis_dimension}_月份红单趋势{download_suffix}_{start_month}_{end_month}.xlsx"
-                        st.markdown(
-                            generate_trend_download_link(df_with_avg, download_filename, "📥 下载趋势数据（含平均值）"),
-                            unsafe_allow_html=True
-                        )
-                    else:
-                        st.write("⚠️ 筛选后无数据")
+                                st.write("⚠️ 筛选后无数据")
+
+                    # 右侧折线图使用月份汇总的结果
+                    view_mode = trend_view_modes[0]
+                    trend_data, df_with_avg, avg_row = trend_summary_result
 
                 else:
                     st.write("⚠️ 请选择有效的月份范围")
@@ -1394,7 +1538,8 @@ if month_options and selected_month:
                     if not set(required_cols_base).issubset(trend_data.columns):
                         st.error(f"⚠️ 缺少核心列：{required_cols_base}，无法绘制图表")
                     else:
-                        chart_data = trend_data[required_cols].copy().dropna(subset=[COL_DELIVERY_MONTH])
+                        # 列选择本身已生成新表，无需再copy
+                        chart_data = trend_data[required_cols].dropna(subset=[COL_DELIVERY_MONTH])
 
                         # 列别名
                         abs_diff_col = f"{COL_ABS_DIFF}_均值"
@@ -1402,184 +1547,45 @@ if month_options and selected_month:
 
 
                         # 中文年月转换
-                        def convert_to_chinese_month(month_str):
-                            try:
-                                year, month = month_str.split("-")
-                                return f"{year}年{month}月"
-                            except:
-                                return month_str
-
-
                         chart_data["到货年月_中文"] = chart_data[COL_DELIVERY_MONTH].apply(convert_to_chinese_month)
 
-                        # 数值转换
+                        # 聚合结果已是数值类型，只需补空值、保留两位小数
                         if "准时率" in chart_data.columns:
-                            chart_data["准时率"] = pd.to_numeric(chart_data["准时率"], errors='coerce').fillna(0)
+                            chart_data["准时率"] = chart_data["准时率"].fillna(0)
                         if abs_diff_col in chart_data.columns:
-                            chart_data[abs_diff_col] = pd.to_numeric(chart_data[abs_diff_col], errors='coerce').fillna(
-                                0).round(2)
+                            chart_data[abs_diff_col] = chart_data[abs_diff_col].fillna(0).round(2)
                         if diff_col in chart_data.columns:
-                            chart_data[diff_col] = pd.to_numeric(chart_data[diff_col], errors='coerce').fillna(0).round(
-                                2)
+                            chart_data[diff_col] = chart_data[diff_col].fillna(0).round(2)
 
                         # 排序
                         chart_data["年月数值"] = pd.to_datetime(chart_data[COL_DELIVERY_MONTH] + "-01",
                                                                 errors='coerce').dt.to_period("M")
                         chart_data = chart_data.sort_values("年月数值")
 
-                        # 绘图逻辑（适配维度）
-                        if view_mode == "月份汇总（无状态）":
-                            plot_cols = []
-                            if abs_diff_col in chart_data.columns:
-                                plot_cols.append(abs_diff_col)
-                            if diff_col in chart_data.columns:
-                                plot_cols.append(diff_col)
-                            if "准时率" in chart_data.columns:
-                                plot_cols.append("准时率")
-
-                            if plot_cols:
-                                try:
-                                    # 构建折线图（按维度分组）
-                                    fig_kwargs = {
-                                        "data_frame": chart_data,
-                                        "x": "到货年月_中文",
-                                        "y": plot_cols,
-                                        "title": f"{convert_to_chinese_month(start_month)} ~ {convert_to_chinese_month(end_month)} {analysis_dimension}核心指标趋势",
-                                        "labels": {"value": "数值", "variable": "指标", "到货年月_中文": "到货年月"},
-                                        "markers": True,
-                                        "color_discrete_map": {
-                                            abs_diff_col: "red",
-                                            diff_col: "green",
-                                            "准时率": "blue"
-                                        },
-                                        "category_orders": {"到货年月_中文": chart_data["到货年月_中文"].tolist()}
-                                    }
-
-                                    # 维度分组（货代/仓库）
-                                    if analysis_dimension == "货代维度" and COL_FREIGHT in chart_data.columns:
-                                        fig_kwargs["color"] = COL_FREIGHT
-                                        fig_kwargs["line_dash"] = COL_FREIGHT
-                                    elif analysis_dimension == "仓库维度" and COL_WAREHOUSE in chart_data.columns:
-                                        fig_kwargs["color"] = COL_WAREHOUSE
-                                        fig_kwargs["line_dash"] = COL_WAREHOUSE
-
-                                    fig_trend = px.line(**fig_kwargs)
-
-                                    # 折点标注
-                                    for idx, row in chart_data.iterrows():
-                                        x_val = row["到货年月_中文"]
-
-                                        # 维度名称（用于标注区分）
-                                        dim_name = ""
-                                        if analysis_dimension == "货代维度" and COL_FREIGHT in row:
-                                            dim_name = row[COL_FREIGHT]
-                                        elif analysis_dimension == "仓库维度" and COL_WAREHOUSE in row:
-                                            dim_name = row[COL_WAREHOUSE]
-
-                                        # 绝对值差值标注
-                                        if abs_diff_col in chart_data.columns:
-                                            y_abs = row[abs_diff_col]
-                                            fig_trend.add_annotation(
-                                                x=x_val,
-                                                y=y_abs,
-                                                text=f"{dim_name}<br/>{y_abs:.2f}" if dim_name else f"{y_abs:.2f}",
-                                                showarrow=True,
-                                                arrowhead=1,
-                                                ax=0,
-                                                ay=-20,
-                                                font={"size": 8, "color": "red"},
-                                                bgcolor="rgba(255,255,255,0.8)"
-                                            )
-
-                                        # 时效差值标注
-                                        if diff_col in chart_data.columns:
-                                            y_diff = row[diff_col]
-                                            fig_trend.add_annotation(
-                                                x=x_val,
-                                                y=y_diff,
-                                                text=f"{dim_name}<br/>{y_diff:.2f}" if dim_name else f"{y_diff:.2f}",
-                                                showarrow=True,
-                                                arrowhead=1,
-                                                ax=0,
-                                                ay=-40,
-                                                font={"size": 8, "color": "green"},
-                                                bgcolor="rgba(255,255,255,0.8)"
-                                            )
-
-                                        # 准时率标注
-                                        if "准时率" in chart_data.columns:
-                                            y_rate = row["准时率"]
-                                            fig_trend.add_annotation(
-                                                x=x_val,
-                                                y=y_rate,
-                                                text=f"{dim_name}<br/>{y_rate * 100:.1f}%" if dim_name else f"{y_rate * 100:.1f}%",
-                                                showarrow=True,
-                                                arrowhead=1,
-                                                ax=0,
-                                                ay=-60,
-                                                font={"size": 8, "color": "blue"},
-                                                bgcolor="rgba(255,255,255,0.8)"
-                                            )
-
-                                    # 平均值参考线
-                                    if 'avg_row' in locals() and len(avg_row) > 0:
-                                        if abs_diff_col in chart_data.columns:
-                                            avg_abs = float(avg_row.get(abs_diff_col, 0))
-                                            if avg_abs != 0:
-                                                fig_trend.add_hline(
-                                                    y=avg_abs,
-                                                    line_dash="dash",
-                                                    line_color="red",
-                                                    annotation_text=f"绝对值均值: {avg_abs:.2f}",
-                                                    annotation_position="right"
-                                                )
-
-                                        if diff_col in chart_data.columns:
-                                            avg_diff = float(avg_row.get(diff_col, 0))
-                                            if avg_diff != 0:
-                                                fig_trend.add_hline(
-                                                    y=avg_diff,
-                                                    line_dash="dash",
-                                                    line_color="green",
-                                                    annotation_text=f"时效差值均值: {avg_diff:.2f}",
-                                                    annotation_position="right"
-                                                )
-
-                                        if "准时率" in chart_data.columns:
-                                            avg_rate = float(avg_row.get("准时率", 0))
-                                            if avg_rate != 0:
-                                                fig_trend.add_hline(
-                                                    y=avg_rate,
-                                                    line_dash="dash",
-                                                    line_color="blue",
-                                                    annotation_text=f"准时率均值: {avg_rate * 100:.1f}%",
-                                                    annotation_position="right"
-                                                )
-
-                                    # 图表样式优化
-                                    fig_trend.update_layout(
-                                        height=600,
-                                        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
-                                        hovermode="x unified",
-                                        yaxis=dict(rangemode="normal", fixedrange=False),
-                                        xaxis=dict(
-                                            tickangle=45,
-                                            tickfont={"size": 10},
-                                            title={"text": "到货年月", "font": {"size": 12}}
-                                        )
-                                    )
+                        # 绘图逻辑（适配维度，使用月份汇总数据）
+                        plot_cols = []
+                        if abs_diff_col in chart_data.columns:
+                            plot_cols.append(abs_diff_col)
+                        if diff_col in chart_data.columns:
+                            plot_cols.append(diff_col)
+                        if "准时率" in chart_data.columns:
+                            plot_cols.append("准时率")
 
-                                    st.plotly_chart(fig_trend, use_container_width=True)
+                        if plot_cols:
+                            try:
+                                fig_trend = build_trend_line(
+                                    chart_data, plot_cols, analysis_dimension, start_month, end_month,
+                                    tuple(avg_row.items())
+                                )
+                                st.plotly_chart(fig_trend, use_container_width=True)
 
-                                except Exception as e:
-                                    st.error(f"图表生成失败：{str(e)}")
-                                    st.write("### 数据调试信息")
-                                    st.write(f"trend_data列名：{trend_data.columns.tolist()}")
-                                    st.write(f"实际使用列：{required_cols}")
-                            else:
-                                st.write("⚠️ 无可用的指标列生成折线图")
+                            except Exception as e:
+                                st.error(f"图表生成失败：{str(e)}")
+                                st.write("### 数据调试信息")
+                                st.write(f"trend_data列名：{trend_data.columns.tolist()}")
+                                st.write(f"实际使用列：{required_cols}")
                         else:
-                            st.write("⚠️ 请切换为「月份汇总（无状态）」模式查看折线图")
+                            st.write("⚠️ 无可用的指标列生成折线图")
                 else:
                     st.write("⚠️ 请先选择有效的筛选条件并确保有数据")
     else:
@@ -1595,8 +1601,7 @@ if month_options and selected_month:
 
     # 1. 到货年月筛选器（单选+默认“全部”）
     with col1:
-        month_unique = df_red["到货年月"].dropna().unique()
-        month_options_filter = ["全部"] + sorted(month_unique, reverse=True) if len(month_unique) > 0 else ["全部"]
+        month_options_filter = ["全部"] + month_options
         selected_month_filter = st.selectbox(
             "到货年月",
             options=month_options_filter,
@@ -1604,13 +1609,12 @@ if month_options and selected_month:
             key="filter_month_single"
         )
 
+    # 仓库/货代/提前延期的可选值只在首次运行时扫描一次
+    source_options = source_filter_options(df_red)
+
     # 2. 仓库筛选器（单选+默认“全部”）
     with col2:
-        warehouse_options_filter = ["全部"]
-        if "仓库" in df_red.columns:
-            warehouse_unique = df_red["仓库"].dropna().unique()
-            if len(warehouse_unique) > 0:
-                warehouse_options_filter += list(warehouse_unique)
+        warehouse_options_filter = ["全部"] + source_options.get("仓库", [])
         selected_warehouse_filter = st.selectbox(
             "仓库",
             options=warehouse_options_filter,
@@ -1620,11 +1624,7 @@ if month_options and selected_month:
 
     # 3. 货代筛选器（单选+默认“全部”）
     with col3:
-        freight_options_filter = ["全部"]
-        if "货代" in df_red.columns:
-            freight_unique = df_red["货代"].dropna().unique()
-            if len(freight_unique) > 0:
-                freight_options_filter += list(freight_unique)
+        freight_options_filter = ["全部"] + source_options.get("货代", [])
         selected_freight_filter = st.selectbox(
             "货代",
             options=freight_options_filter,
@@ -1634,11 +1634,7 @@ if month_options and selected_month:
 
     # 4. 提前/延期筛选器（单选+默认“全部”）
     with col4:
-        status_options_filter = ["全部"]
-        if "提前/延期" in df_red.columns:
-            status_unique = df_red["提前/延期"].dropna().unique()
-            if len(status_unique) > 0:
-                status_options_filter += list(status_unique)
+        status_options_filter = ["全部"] + source_options.get("提前/延期", [])
         selected_status_filter = st.selectbox(
             "提前/延期",
             options=status_options_filter,
@@ -1647,16 +1643,12 @@ if month_options and selected_month:
         )
 
     # ---------------------- 应用筛选逻辑 ----------------------
-    filter_conditions = pd.Series([True] * len(df_red))
-    if selected_month_filter != "全部" and len(df_red) > 0:
-        filter_conditions = filter_conditions & (df_red["到货年月"] == selected_month_filter)
-    if "仓库" in df_red.columns and selected_warehouse_filter != "全部" and len(df_red) > 0:
-        filter_conditions = filter_conditions & (df_red["仓库"] == selected_warehouse_filter)
-    if "货代" in df_red.columns and selected_freight_filter != "全部" and len(df_red) > 0:
-        filter_conditions = filter_conditions & (df_red["货代"] == selected_freight_filter)
-    if "提前/延期" in df_red.columns and selected_status_filter != "全部" and len(df_red) > 0:
-        filter_conditions = filter_conditions & (df_red["提前/延期"] == selected_status_filter)
-    df_filtered = df_red[filter_conditions].copy()
+    # 显示列在加载后已算好，这里直接复用
+    display_cols = SOURCE_DISPLAY_COLS
+    # 筛选时只取要显示的列，其余列不参与复制
+    df_filtered = filter_source_data(
+        df_red, selected_month_filter, selected_warehouse_filter, selected_freight_filter, selected_status_filter
+    )
 
     # ---------------------- 计算平均值 ----------------------
     avg_target_cols = [
@@ -1664,13 +1656,6 @@ if month_options and selected_month:
         "发货-签收", "发货-完成上架", "签收-发货时间", "上架完成-发货时间",
         "预计物流时效-实际物流时效差值(绝对值)", "预计物流时效-实际物流时效差值"
     ]
-    display_cols = [
-        "到货年月", "FBA号", "店铺", "仓库", "货代", "提前/延期",
-        "异常备注", "发货-提取", "提取-到港", "到港-签收", "签收-完成上架",
-        "发货-签收", "发货-完成上架", "签收-发货时间", "上架完成-发货时间",
-        "预计物流时效-实际物流时效差值(绝对值)", "预计物流时效-实际物流时效差值"
-    ]
-    display_cols = [col for col in display_cols if col in df_filtered.columns]
 
     # 初始化平均值
     avg_row = {col: "-" for col in display_cols}
@@ -1678,17 +1663,31 @@ if month_options and selected_month:
         for col in avg_target_cols:
             if col in display_cols:
                 numeric_vals = pd.to_numeric(df_filtered[col], errors='coerce').dropna()
-                avg_row[col] = round(numeric_vals.mean(), 2) if len(numeric_vals) > 0 else 0.00
+                avg_row[col] = round(float(numeric_vals.mean()), 2) if len(numeric_vals) > 0 else 0.00
 
-    # 处理数据行
-    df_display = df_filtered[display_cols].copy() if len(df_filtered) > 0 else pd.DataFrame(columns=display_cols)
+    # 处理数据行（数值列统一为float64，保证下面按Python数值类型格式化和比较）
+    # 筛选结果已只含显示列，且缓存返回的是独立副本，直接在其上转换类型
+    df_display = df_filtered if len(df_filtered) > 0 else pd.DataFrame(columns=display_cols)
     for col in avg_target_cols:
         if col in df_display.columns:
-            df_display[col] = pd.to_numeric(df_display[col], errors='coerce')
+            df_display[col] = pd.to_numeric(df_display[col], errors='coerce').astype("float64")
 
     # ---------------------- 生成表格（修复样式语法） ----------------------
     st.markdown("### 原始数据（含筛选后平均值）")
 
+    # 行数较多时分页显示（平均值仍按全部筛选结果计算）
+    page_count = (len(df_display) - 1) // SOURCE_PAGE_ROWS + 1 if len(df_display) > 0 else 1
+    if page_count > 1:
+        page = st.number_input(
+            f"页码（共 {page_count} 页，每页 {SOURCE_PAGE_ROWS} 条）",
+            min_value=1,
+            max_value=page_count,
+            value=1,
+            step=1,
+            key="filter_page"
+        )
+        df_display = df_display.iloc[(page - 1) * SOURCE_PAGE_ROWS:page * SOURCE_PAGE_ROWS]
+
     # 列宽配置（简化为单行字符串，避免语法错误）
     col_width_config = {
         "到货年月": "80px", "FBA号": "120px", "店铺": "80px", "仓库": "80px",
@@ -1795,18 +1794,22 @@ if month_options and selected_month:
     # 构建数据行
     data_html = "<table class='table-data'><tbody>"
     if len(df_display) > 0:
-        for _, row in df_display.iterrows():
-            data_html += "<tr>"
-            for col in display_cols:
-                width = col_width_config.get(col, "100px")
-                val = row[col]
-                highlight = "highlight" if (
-                            col in avg_target_cols and pd.notna(val) and pd.notna(avg_row[col]) and isinstance(
-                        avg_row[col], (int, float)) and float(val) > avg_row[col]) else ""
-                display_val = f"{val:.2f}" if (col in avg_target_cols and isinstance(val, (int, float))) else (
-                    "" if pd.isna(val) else str(val))
-                data_html += f"<td style='--col-width: {width}' class='{highlight}'>{display_val}</td>"
-            data_html += "</tr>"
+        # 按列整体生成单元格：数值列一次格式化为两位小数、一次与平均值比较得到高亮标记，
+        # 再把各列单元格按行拼接（不逐行iterrows取值）
+        row_html = np.full(len(df_display), "<tr>", dtype=object)
+        for col in display_cols:
+            width = col_width_config.get(col, "100px")
+            if col in avg_target_cols:
+                vals = df_display[col].to_numpy(dtype="float64")
+                display_vals = np.char.mod("%.2f", vals).astype(object)
+                avg_val = avg_row[col]
+                highlight = np.where(vals > avg_val, "highlight", "").astype(object) if isinstance(avg_val, (int, float)) else ""
+            else:
+                col_vals = df_display[col].astype(object)
+                display_vals = col_vals.where(col_vals.notna(), "").astype(str).to_numpy(dtype=object)
+                highlight = ""
+            row_html = row_html + f"<td style='--col-width: {width}' class='" + highlight + "'>" + display_vals + "</td>"
+        data_html += "".join(row_html + "</tr>")
     else:
         data_html += f"<tr><td colspan='{len(display_cols)}' style='text-align: center; padding: 20px;'>⚠️ 暂无符合筛选条件的数据</td></tr>"
     data_html += "</tbody></table>"
@@ -1889,52 +1892,14 @@ def render_air_dashboard(df_air):
         diff_change_text = f"{'↑' if diff_change > 0 else '↓' if diff_change < 0 else '—'} {abs(diff_change):.2f} (上月: {prev_diff_avg:.2f})"
         diff_change_color = "red" if diff_change > 0 else "green" if diff_change < 0 else "gray"
 
-        # 显示卡片（仅修改标题文本）
-        col1, col2, col3, col4, col5 = st.columns(5)
-        with col1:
-            st.markdown(f"""
-            <div style='background-color: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center;'>
-                <h5 style='margin: 0; color: #333;'>FBA单</h5>
-                <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_fba}</p>
-                <p style='font-size: 14px; color: {fba_change_color}; margin: 0;'>{fba_change_text}</p>
-            </div>
-            """, unsafe_allow_html=True)
-
-        with col2:
-            st.markdown(f"""
-            <div style='background-color: #f0f8f0; padding: 15px; border-radius: 8px; text-align: center;'>
-                <h5 style='margin: 0; color: green;'>提前/准时数</h5>
-                <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_on_time}</p>
-                <p style='font-size: 14px; color: {on_time_change_color}; margin: 0;'>{on_time_change_text}</p>
-            </div>
-            """, unsafe_allow_html=True)
-
-        with col3:
-            st.markdown(f"""
-            <div style='background-color: #fff0f0; padding: 15px; border-radius: 8px; text-align: center;'>
-                <h5 style='margin: 0; color: red;'>延期数</h5>
-                <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_delay}</p>
-                <p style='font-size: 14px; color: {delay_change_color}; margin: 0;'>{delay_change_text}</p>
-            </div>
-            """, unsafe_allow_html=True)
-
-        with col4:
-            st.markdown(f"""
-            <div style='background-color: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center;'>
-                <h5 style='margin: 0; color: #333;'>绝对值差值均值</h5>
-                <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_abs_avg:.2f}</p>
-                <p style='font-size: 14px; color: {abs_change_color}; margin: 0;'>{abs_change_text}</p>
-            </div>
-            """, unsafe_allow_html=True)
-
-        with col5:
-            st.markdown(f"""
-            <div style='background-color: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center;'>
-                <h5 style='margin: 0; color: #333;'>实际差值均值</h5>
-                <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_diff_avg:.2f}</p>
-                <p style='font-size: 14px; color: {diff_change_color}; margin: 0;'>{diff_change_text}</p>
-            </div>
-            """, unsafe_allow_html=True)
+        # 显示卡片（仅修改标题文本，flex横向排列，一次渲染）
+        st.markdown(build_metric_cards_html([
+            ("FBA单", "#333", "#f8f9fa", current_fba, fba_change_color, fba_change_text),
+            ("提前/准时数", "green", "#f0f8f0", current_on_time, on_time_change_color, on_time_change_text),
+            ("延期数", "red", "#fff0f0", current_delay, delay_change_color, delay_change_text),
+            ("绝对值差值均值", "#333", "#f8f9fa", f"{current_abs_avg:.2f}", abs_change_color, abs_change_text),
+            ("实际差值均值", "#333", "#f8f9fa", f"{current_diff_avg:.2f}", diff_change_color, diff_change_text)
+        ]), unsafe_allow_html=True)
 
         # 生成总结文字（仅修改“红单”为“空派”）
         summary_text = f"""
@@ -1959,7 +1924,9 @@ def render_air_dashboard(df_air):
         # 左：饼图（仅修改标题文本）
         with col1:
             if "提前/延期" in df_current.columns and len(df_current) > 0:
-                pie_data = df_current["提前/延期"].value_counts()
+                # 分类列按编码计数；不按数量排序（饼图扇区由Plotly自行排序），去掉未出现状态的0计数
+                pie_data = df_current["提前/延期"].value_counts(sort=False)
+                pie_data = pie_data[pie_data > 0]
                 categories = pie_data.index.tolist()
                 colors = []
                 for cat in categories:
@@ -2000,30 +1967,24 @@ def render_air_dashboard(df_air):
                 )
                 max_display_length = 20
 
+                # 每个区间整张直方图拼成一段HTML一次性渲染
                 st.markdown("#### 提前/准时区间分布")
                 if not early_counts.empty:
-                    for day, count in early_counts.items():
-                        display_length = int((count / max_count) * max_display_length) if max_count > 0 else 0
-                        bar = "█" * display_length
-                        day_label = f"+{day}天" if day > 0 else "0天"
-                        st.markdown(
-                            f"<div style='font-family: monospace;'><span style='display: inline-block; width: 60px;'>{day_label}</span>"
-                            f"<span style='color: green;'>{bar}</span> <span> ({count})</span></div>",
-                            unsafe_allow_html=True
-                        )
+                    day_labels = [f"+{day}天" if day > 0 else "0天" for day in early_counts.index]
+                    st.markdown(
+                        build_text_histogram_html(day_labels, early_counts, max_count, "green", max_display_length),
+                        unsafe_allow_html=True
+                    )
                 else:
                     st.text("暂无提前/准时数据")
 
                 st.markdown("#### 延迟区间分布")
                 if not delay_counts.empty:
-                    for day, count in delay_counts.items():
-                        display_length = int((count / max_count) * max_display_length) if max_count > 0 else 0
-                        bar = "█" * display_length
-                        st.markdown(
-                            f"<div style='font-family: monospace;'><span style='display: inline-block; width: 60px;'>{day}天</span>"
-                            f"<span style='color: red;'>{bar}</span> <span> ({count})</span></div>",
-                            unsafe_allow_html=True
-                        )
+                    day_labels = [f"{day}天" for day in delay_counts.index]
+                    st.markdown(
+                        build_text_histogram_html(day_labels, delay_counts, max_count, "red", max_display_length),
+                        unsafe_allow_html=True
+                    )
                 else:
                     st.text("暂无延迟数据")
             else:
@@ -2042,7 +2003,7 @@ def render_air_dashboard(df_air):
             abs_col, diff_col
         ]
         detail_cols = [col for col in detail_cols if col in df_current.columns]
-        df_detail = df_current[detail_cols].copy() if len(detail_cols) > 0 else pd.DataFrame()
+        df_detail = df_current[detail_cols] if len(detail_cols) > 0 else pd.DataFrame()
 
         if len(df_detail) > 0:
             if diff_col in df_detail.columns:
@@ -2055,8 +2016,12 @@ def render_air_dashboard(df_air):
             ]
             int_cols = [col for col in int_cols if col in df_detail.columns]
 
-            for col in int_cols:
-                df_detail[col] = pd.to_numeric(df_detail[col], errors='coerce').fillna(0).astype(int)
+            # 将整数列整块转换为无小数点格式（空值填充为0）：一次二维转换，不再逐列生成新Series
+            if int_cols:
+                df_detail[int_cols] = (
+                    df_detail[int_cols].apply(pd.to_numeric, errors='coerce').fillna(0)
+                    .to_numpy(dtype="float64").astype("int32")
+                )
 
             # 计算平均值行（清关耗时不计算平均值）
             avg_row = {}
@@ -2198,13 +2163,13 @@ def render_air_dashboard(df_air):
 
             # 下载功能（仅修改文件名）
             df_download = pd.concat([pd.DataFrame([avg_row]), df_detail], ignore_index=True)
-            st.markdown(
-                generate_download_link(
-                    df_download,
-                    f"空派明细_{selected_month}.xlsx",  # 红单→空派
-                    "📥 下载空派明细表格（Excel格式）"  # 红单→空派
-                ),
-                unsafe_allow_html=True
+            st.download_button(
+                "📥 下载空派明细表格（Excel格式）",  # 红单→空派
+                data=df_to_excel_bytes(df_download, "空派明细"),
+                file_name=f"空派明细_{selected_month}.xlsx",  # 红单→空派
+                mime=EXCEL_MIME,
+                on_click="ignore",
+                key="air_detail_download"
             )
         else:
             st.write("⚠️ 暂无明细数据")
@@ -2218,7 +2183,7 @@ def render_air_dashboard(df_air):
 
             # 左：柱状图（仅修改标题）
             with col1:
-                freight_data = df_current.groupby(["货代", "提前/延期"]).size().unstack(fill_value=0)
+                freight_data = df_current.groupby(["货代", "提前/延期"], observed=True).size().unstack(fill_value=0)
                 if "提前/准时" not in freight_data.columns:
                     freight_data["提前/准时"] = 0
                 if "延期" not in freight_data.columns:
@@ -2244,28 +2209,30 @@ def render_air_dashboard(df_air):
                 )
 
                 if delay_filter == "仅提前/准时":
-                    df_filtered = df_current[df_current["提前/延期"] == "提前/准时"].copy()
+                    df_filtered = df_current[df_current["提前/延期"] == "提前/准时"]
                 elif delay_filter == "仅延期":
-                    df_filtered = df_current[df_current["提前/延期"] == "延期"].copy()
+                    df_filtered = df_current[df_current["提前/延期"] == "延期"]
                 else:
-                    df_filtered = df_current.copy()
+                    df_filtered = df_current
 
                 # 聚合数据（逻辑一致）
-                freight_detail = df_filtered.groupby(["货代", "提前/延期"]).agg(
+                # 准时标记列（1=提前/准时），准时率直接取均值，避免groupby中逐组调用lambda
+                df_filtered = df_filtered.assign(是否准时=(df_filtered["提前/延期"] == "提前/准时").astype("int8"))
+                freight_detail = df_filtered.groupby(["货代", "提前/延期"], observed=True).agg(
                     订单个数=("FBA号", "count"),
-                    准时率=("提前/延期", lambda x: (x == "提前/准时").sum() / len(x) if len(x) > 0 else 0),
+                    准时率=("是否准时", "mean"),
                     **{
-                        f"{abs_col}_均值": (abs_col, "mean") if abs_col in df_filtered.columns else 0,
-                        f"{diff_col}_均值": (diff_col, "mean") if diff_col in df_filtered.columns else 0
+                        f"{col}_均值": (col, "mean")
+                        for col in [abs_col, diff_col] if col in df_filtered.columns
                     }
                 ).reset_index()
 
-                freight_summary = df_filtered.groupby("货代").agg(
+                freight_summary = df_filtered.groupby("货代", observed=True).agg(
                     总订单个数=("FBA号", "count"),
-                    整体准时率=("提前/延期", lambda x: (x == "提前/准时").sum() / len(x) if len(x) > 0 else 0),
+                    整体准时率=("是否准时", "mean"),
                     **{
-                        f"{abs_col}_整体均值": (abs_col, "mean") if abs_col in df_filtered.columns else 0,
-                        f"{diff_col}_整体均值": (diff_col, "mean") if diff_col in df_filtered.columns else 0
+                        f"{col}_整体均值": (col, "mean")
+                        for col in [abs_col, diff_col] if col in df_filtered.columns
                     }
                 ).reset_index()
 
@@ -2322,9 +2289,13 @@ def render_air_dashboard(df_air):
                 # 下载（仅修改文件名）
                 download_df = freight_summary if view_mode == "货代汇总（无状态）" else freight_detail
                 download_filename = f"空派货代分析_{selected_month}_{view_mode.replace('（', '').replace('）', '').replace(' ', '')}.xlsx"  # 红单→空派
-                st.markdown(
-                    generate_download_link(download_df, download_filename, "📥 下载当前表格数据"),
-                    unsafe_allow_html=True
+                st.download_button(
+                    "📥 下载当前表格数据",
+                    data=df_to_excel_bytes(download_df, "货代分析"),
+                    file_name=download_filename,
+                    mime=EXCEL_MIME,
+                    on_click="ignore",
+                    key="air_freight_download"
                 )
         else:
             st.write("⚠️ 暂无货代准时情况数据")
@@ -2339,7 +2310,7 @@ def render_air_dashboard(df_air):
 
             # 左：柱状图（仅修改标题）
             with col1:
-                warehouse_data = df_current.groupby(["仓库", "提前/延期"]).size().unstack(fill_value=0)
+                warehouse_data = df_current.groupby(["仓库", "提前/延期"], observed=True).size().unstack(fill_value=0)
                 if "提前/准时" not in warehouse_data.columns:
                     warehouse_data["提前/准时"] = 0
                 if "延期" not in warehouse_data.columns:
@@ -2365,28 +2336,30 @@ def render_air_dashboard(df_air):
                 )
 
                 if delay_filter == "仅提前/准时":
-                    df_filtered = df_current[df_current["提前/延期"] == "提前/准时"].copy()
+                    df_filtered = df_current[df_current["提前/延期"] == "提前/准时"]
                 elif delay_filter == "仅延期":
-                    df_filtered = df_current[df_current["提前/延期"] == "延期"].copy()
+                    df_filtered = df_current[df_current["提前/延期"] == "延期"]
                 else:
-                    df_filtered = df_current.copy()
+                    df_filtered = df_current
 
                 # 聚合数据（逻辑一致）
-                warehouse_detail = df_filtered.groupby(["仓库", "提前/延期"]).agg(
+                # 准时标记列（1=提前/准时），准时率直接取均值，避免groupby中逐组调用lambda
+                df_filtered = df_filtered.assign(是否准时=(df_filtered["提前/延期"] == "提前/准时").astype("int8"))
+                warehouse_detail = df_filtered.groupby(["仓库", "提前/延期"], observed=True).agg(
                     订单个数=("FBA号", "count"),
-                    准时率=("提前/延期", lambda x: (x == "提前/准时").sum() / len(x) if len(x) > 0 else 0),
+                    准时率=("是否准时", "mean"),
                     **{
-                        f"{abs_col}_均值": (abs_col, "mean") if abs_col in df_filtered.columns else 0,
-                        f"{diff_col}_均值": (diff_col, "mean") if diff_col in df_filtered.columns else 0
+                        f"{col}_均值": (col, "mean")
+                        for col in [abs_col, diff_col] if col in df_filtered.columns
                     }
                 ).reset_index()
 
-                warehouse_summary = df_filtered.groupby("仓库").agg(
+                warehouse_summary = df_filtered.groupby("仓库", observed=True).agg(
                     总订单个数=("FBA号", "count"),
-                    整体准时率=("提前/延期", lambda x: (x == "提前/准时").sum() / len(x) if len(x) > 0 else 0),
+                    整体准时率=("是否准时", "mean"),
                     **{
-                        f"{abs_col}_整体均值": (abs_col, "mean") if abs_col in df_filtered.columns else 0,
-                        f"{diff_col}_整体均值": (diff_col, "mean") if diff_col in df_filtered.columns else 0
+                        f"{col}_整体均值": (col, "mean")
+                        for col in [abs_col, diff_col] if col in df_filtered.columns
                     }
                 ).reset_index()
 
@@ -2443,9 +2416,13 @@ def render_air_dashboard(df_air):
                 # 下载（仅修改文件名）
                 download_df = warehouse_summary if view_mode == "仓库汇总（无状态）" else warehouse_detail
                 download_filename = f"空派仓库分析_{selected_month}_{view_mode.replace('（', '').replace('）', '').replace(' ', '')}.xlsx"  # 红单→空派
-                st.markdown(
-                    generate_download_link(download_df, download_filename, "📥 下载当前表格数据"),
-                    unsafe_allow_html=True
+                st.download_button(
+                    "📥 下载当前表格数据",
+                    data=df_to_excel_bytes(download_df, "仓库分析"),
+                    file_name=download_filename,
+                    mime=EXCEL_MIME,
+                    on_click="ignore",
+                    key="air_warehouse_download"
                 )
         else:
             st.write("⚠️ 暂无仓库准时情况数据")
@@ -2489,7 +2466,8 @@ def render_air_dashboard(df_air):
                 # 左侧：趋势表格（逻辑一致，仅修改key和文本）
                 with col1:
                     st.markdown("#### 分析条件设置")
-                    all_months_trend = sorted(df_air[COL_DELIVERY_MONTH].dropna().unique())
+                    # 复用当月分析已排好序的月份列表（倒序转为正序），不再对全表去重排序
+                    all_months_trend = month_options[::-1]
 
                     if len(all_months_trend) >= 2:
                         default_start = all_months_trend[-3] if len(all_months_trend) >= 3 else all_months_trend[0]
@@ -2562,17 +2540,17 @@ def render_air_dashboard(df_air):
                         df_trend_filtered = df_air[
                             (df_air[COL_DELIVERY_MONTH].apply(month_to_num) >= month_to_num(start_month)) &
                             (df_air[COL_DELIVERY_MONTH].apply(month_to_num) <= month_to_num(end_month))
-                            ].copy()
+                            ]
 
                         if delay_filter == "仅提前/准时":
-                            df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_DELAY_STATUS] == "提前/准时"].copy()
+                            df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_DELAY_STATUS] == "提前/准时"]
                         elif delay_filter == "仅延期":
-                            df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_DELAY_STATUS] == "延期"].copy()
+                            df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_DELAY_STATUS] == "延期"]
 
                         if analysis_dimension == "货代维度" and selected_dimension is not None:
-                            df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_FREIGHT] == selected_dimension].copy()
+                            df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_FREIGHT] == selected_dimension]
                         elif analysis_dimension == "仓库维度" and selected_dimension is not None:
-                            df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_WAREHOUSE] == selected_dimension].copy()
+                            df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_WAREHOUSE] == selected_dimension]
 
                         # 聚合数据（逻辑一致）
                         trend_data = pd.DataFrame()
@@ -2589,15 +2567,15 @@ def render_air_dashboard(df_air):
                             try:
                                 # 订单个数
                                 if COL_FBA_NO in df_trend_filtered.columns:
-                                    df_count = df_trend_filtered.groupby(group_cols)[COL_FBA_NO].count().reset_index()
+                                    df_count = df_trend_filtered.groupby(group_cols, observed=True)[COL_FBA_NO].count().reset_index()
                                     df_count.rename(columns={COL_FBA_NO: "订单个数"}, inplace=True)
                                 else:
-                                    df_count = df_trend_filtered.groupby(group_cols).size().reset_index(name="订单个数")
+                                    df_count = df_trend_filtered.groupby(group_cols, observed=True).size().reset_index(name="订单个数")
 
                                 # 准时率
                                 df_delay = df_trend_filtered.copy()
                                 df_delay["是否准时"] = df_delay[COL_DELAY_STATUS] == "提前/准时"
-                                df_rate = df_delay.groupby(group_cols).agg({
+                                df_rate = df_delay.groupby(group_cols, observed=True).agg({
                                     "是否准时": ["sum", "count"]
                                 }).reset_index()
                                 df_rate.columns = group_cols + ["准时订单数", "总订单数"]
@@ -2614,7 +2592,7 @@ def render_air_dashboard(df_air):
                                         agg_diff_dict[COL_DIFF] = "mean"
 
                                     if agg_diff_dict:
-                                        df_diff = df_trend_filtered.groupby(group_cols).agg(agg_diff_dict).reset_index()
+                                        df_diff = df_trend_filtered.groupby(group_cols, observed=True).agg(agg_diff_dict).reset_index()
                                         if COL_ABS_DIFF in df_diff.columns:
                                             df_diff.rename(columns={COL_ABS_DIFF: f"{COL_ABS_DIFF}_均值"}, inplace=True)
                                         if COL_DIFF in df_diff.columns:
@@ -2664,7 +2642,7 @@ def render_air_dashboard(df_air):
 
                             # 环比计算（逻辑一致）
                             def calculate_monthly_diff(df, base_col, group_cols=[COL_DELIVERY_MONTH]):
-                                df_data = df.iloc[1:].copy() if len(df) > 1 else df.copy()
+                                df_data = df.iloc[1:] if len(df) > 1 else df.copy()
                                 if len(df_data) == 0 or base_col not in df_data.columns:
                                     return df
 
@@ -2674,7 +2652,7 @@ def render_air_dashboard(df_air):
 
                                 diff_group_cols = [c for c in group_cols if c not in [COL_DELIVERY_MONTH]]
                                 if diff_group_cols and all(col in df_data.columns for col in diff_group_cols):
-                                    df_data[f"{base_col}_环比差值"] = df_data.groupby(diff_group_cols)[base_col].diff()
+                                    df_data[f"{base_col}_环比差值"] = df_data.groupby(diff_group_cols, observed=True)[base_col].diff()
                                 else:
                                     df_data[f"{base_col}_环比差值"] = df_data[base_col].diff()
 
@@ -2849,9 +2827,13 @@ def render_air_dashboard(df_air):
                             # 下载（仅修改文件名）
                             download_suffix = f"_{selected_dimension}" if selected_dimension else ""
                             download_filename = f"空派{analysis_dimension}_月份趋势{download_suffix}_{start_month}_{end_month}.xlsx"  # 红单→空派
-                            st.markdown(
-                                generate_download_link(df_with_avg, download_filename, "📥 下载趋势数据（含平均值）"),
-                                unsafe_allow_html=True
+                            st.download_button(
+                                "📥 下载趋势数据（含平均值）",
+                                data=df_to_excel_bytes(df_with_avg, f"{analysis_dimension}趋势"),
+                                file_name=download_filename,
+                                mime=EXCEL_MIME,
+                                on_click="ignore",
+                                key="air_trend_download"
                             )
                         else:
                             st.write("⚠️ 筛选后无数据")
@@ -2889,7 +2871,7 @@ def render_air_dashboard(df_air):
                         if not set(required_cols_base).issubset(trend_data.columns):
                             st.error(f"⚠️ 缺少核心列：{required_cols_base}，无法绘制图表")
                         else:
-                            chart_data = trend_data[required_cols].copy().dropna(subset=[COL_DELIVERY_MONTH])
+                            chart_data = trend_data[required_cols].dropna(subset=[COL_DELIVERY_MONTH])
 
                             abs_diff_col = f"{COL_ABS_DIFF}_均值"
                             diff_col = f"{COL_DIFF}_均值"
@@ -2924,6 +2906,7 @@ def render_air_dashboard(df_air):
                                             "title": f"{convert_to_chinese_month(start_month)} ~ {convert_to_chinese_month(end_month)} {analysis_dimension}核心指标趋势",
                                             "labels": {"value": "数值", "variable": "指标", "到货年月_中文": "到货年月"},
                                             "markers": True,
+                                            "render_mode": "webgl",
                                             "color_discrete_map": {
                                                 abs_diff_col: "red",
                                                 diff_col: "green",
@@ -3062,7 +3045,7 @@ def render_air_dashboard(df_air):
         with col_filter1:
             filter_month = st.multiselect(
                 "筛选到货年月",
-                options=sorted(df_air["到货年月"].unique()),
+                options=month_options[::-1],
                 default=None,
                 key="air_filter_month"
             )
@@ -3112,25 +3095,18 @@ def render_air_dashboard(df_air):
             )
 
         # 应用筛选（逻辑一致，新增清关耗时过滤）
-        df_filtered = df_air.copy()
-        if filter_month:
-            df_filtered = df_filtered[df_filtered["到货年月"].isin(filter_month)]
-        if filter_freight:
-            df_filtered = df_filtered[df_filtered["货代"].isin(filter_freight)]
-        if filter_warehouse:
-            df_filtered = df_filtered[df_filtered["仓库"].isin(filter_warehouse)]
-        if filter_status:
-            df_filtered = df_filtered[df_filtered["提前/延期"].isin(filter_status)]
-        if filter_shop:
-            df_filtered = df_filtered[df_filtered["店铺"].isin(filter_shop)]
-        # 清关耗时筛选
-        if "清关耗时" in df_filtered.columns:
-            df_filtered["清关耗时_numeric"] = pd.to_numeric(df_filtered["清关耗时"], errors='coerce')
-            df_filtered = df_filtered[
-                (df_filtered["清关耗时_numeric"] >= customs_min) &
-                (df_filtered["清关耗时_numeric"] <= customs_max)
-            ]
-            df_filtered = df_filtered.drop("清关耗时_numeric", axis=1)
+        # 各条件只在原表上生成布尔掩码，合并后按行号一次取出子表，不再复制全表、逐步生成中间子表
+        filter_masks = [
+            df_air[col].isin(values).to_numpy()
+            for col, values in [("到货年月", filter_month), ("货代", filter_freight), ("仓库", filter_warehouse),
+                                ("提前/延期", filter_status), ("店铺", filter_shop)]
+            if values
+        ]
+        # 清关耗时筛选（空值不满足区间条件）
+        if "清关耗时" in df_air.columns:
+            customs_days = pd.to_numeric(df_air["清关耗时"], errors='coerce').to_numpy(dtype="float64", na_value=np.nan)
+            filter_masks.append((customs_days >= customs_min) & (customs_days <= customs_max))
+        df_filtered = df_air.iloc[np.flatnonzero(np.logical_and.reduce(filter_masks))] if filter_masks else df_air
 
         # 显示列配置（适配空派列名）
         avg_target_cols = [
@@ -3153,10 +3129,10 @@ def render_air_dashboard(df_air):
             for col in avg_target_cols:
                 if col in display_cols and col != "清关耗时":  # 清关耗时不计算均值
                     numeric_vals = pd.to_numeric(df_filtered[col], errors='coerce').dropna()
-                    avg_row[col] = round(numeric_vals.mean(), 2) if len(numeric_vals) > 0 else 0.00
+                    avg_row[col] = round(float(numeric_vals.mean()), 2) if len(numeric_vals) > 0 else 0.00
 
         # 处理数据行
-        df_display = df_filtered[display_cols].copy() if len(df_filtered) > 0 else pd.DataFrame(columns=display_cols)
+        df_display = df_filtered[display_cols] if len(df_filtered) > 0 else pd.DataFrame(columns=display_cols)
         for col in avg_target_cols:
             if col in df_display.columns and col != "清关耗时":
                 df_display[col] = pd.to_numeric(df_display[col], errors='coerce')
@@ -3323,13 +3299,22 @@ def render_air_dashboard(df_air):
             st.caption("⚠️ 暂无符合筛选条件的空派业务数据")
 
         # 下载筛选后数据（仅修改文件名）
-        if len(df_filtered) > 0:
-            st.markdown(
-                generate_download_link(
-                    df_filtered,
-                    "空派筛选数据.xlsx",
-                    "📥 下载当前筛选结果（Excel格式）"
-                ),
-                unsafe_allow_html=True
+        if len(df_filtered) > LARGE_EXPORT_ROWS:
+            st.download_button(
+                "📥 下载当前筛选结果（CSV格式）",
+                data=df_to_csv_bytes(df_filtered),
+                file_name="空派筛选数据.csv",
+                mime="text/csv",
+                on_click="ignore",
+                key="air_filtered_download"
+            )
+        elif len(df_filtered) > 0:
+            st.download_button(
+                "📥 下载当前筛选结果（Excel格式）",
+                data=df_to_excel_bytes(df_filtered, "空派筛选数据"),
+                file_name="空派筛选数据.xlsx",
+                mime=EXCEL_MIME,
+                on_click="ignore",
+                key="air_filtered_download"
             )
 
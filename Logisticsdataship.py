@@ -3,8 +3,8 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime
 import warnings
+from io import BytesIO
 
 warnings.filterwarnings('ignore')
 
@@ -23,20 +23,21 @@ def load_data():
     """读取海运数据并预处理"""
     # 读取指定sheet
     url = "https://github.com/Jane-zzz-123/Logistics/raw/main/Logisticsdata.xlsx"
-    df_air = pd.read_excel(url, sheet_name="上架完成-海运")
-
     # 指定需要分析的列
     target_cols = [
         "FBA号", "店铺", "仓库", "货代","实际货代渠道","发货周次","异常备注",
         "发货-开船", "开船-到港", "到港-提柜", "提柜-签收",
-        "到港-签收", "开船-签收","签收-完成上架","开船-完成上架","创件-完成上架"
+        "到港-签收", "开船-签收","签收-完成上架","开船-完成上架","创件-完成上架",
 	    "到货年月",
         "签收-发货时间", "上架完成-发货时间",
         "预计物流时效-实际物流时效差值(绝对值)",
         "预计物流时效-实际物流时效差值", "提前/延期"
     ]
 
-    # 确保只保留目标列（处理列名可能的空格/大小写问题）
+    # calamine引擎解析速度远快于openpyxl；usecols让解析阶段直接跳过无关列（不存在的目标列自动忽略）
+    df_air = pd.read_excel(url, sheet_name="上架完成-海运", engine="calamine", usecols=lambda col: col in target_cols)
+
+    # 按目标列顺序排列
     df_air = df_air[[col for col in target_cols if col in df_air.columns]]
 
     # 数据类型处理
@@ -49,26 +50,44 @@ def load_data():
         "预计物流时效-实际物流时效差值(绝对值)",
         "预计物流时效-实际物流时效差值"
     ]
-    for col in numeric_cols:
-        if col in df_air.columns:
-            df_air[col] = pd.to_numeric(df_air[col], errors='coerce').fillna(0)
+    # 一次性转换为连续的numpy数组处理空值，再整体写回（保持float64：均值按两位小数四舍五入时与原先结果一致）
+    present_cols = [col for col in numeric_cols if col in df_air.columns]
+    numeric_arr = df_air[present_cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype="float64", na_value=np.nan)
+    df_air[present_cols] = np.nan_to_num(numeric_arr, copy=False)
+
+    # 准时标记列（1=提前/准时）加载时只算一次，货代/仓库的准时率聚合直接取均值
+    if "提前/延期" in df_air.columns:
+        df_air["是否准时"] = (df_air["提前/延期"] == "提前/准时").astype("int8")
 
     return df_air
 
 
+# 按到货年月预先分组（常驻缓存，直接返回同一份字典，不随每次重跑反序列化），切换月份时按月份取子表，无需再扫描全表
+@st.cache_resource
+def build_month_groups(_df_air):
+    """返回{到货年月: 当月子表}"""
+    return {
+        month: group.reset_index(drop=True)
+        for month, group in _df_air.groupby("到货年月", sort=False)
+    }
+
+
 # 加载数据
 df_air = load_data()
+month_groups = build_month_groups(df_air)
 
 
 # ---------------------- 工具函数 ----------------------
 def get_prev_month(current_month):
     """获取上个月的年月字符串（格式：YYYY-MM）"""
-    try:
-        current = datetime.strptime(current_month, "%Y-%m")
-        prev_month = current.replace(day=1) - pd.Timedelta(days=1)
-        return prev_month.strftime("%Y-%m")
-    except:
+    # 直接按年月整数推算（1月退到上一年12月），不做日期解析
+    digits = str(current_month).replace("-", "")
+    if len(digits) != 6 or not digits.isdigit():
         return ""
+    year, month = divmod(int(digits), 100)
+    if month == 1:
+        return f"{year - 1}-12"
+    return f"{year}-{month - 1:02d}"
 
 
 def calculate_percent_change(current, prev):
@@ -116,6 +135,100 @@ def highlight_change(val):
     return ""
 
 
+def build_text_histogram_html(labels, counts, max_count, color, max_display_length=20):
+    """生成文本直方图HTML（条形长度按比例缩放，整张图一次性渲染）"""
+    counts = np.asarray(counts)
+    bar_lengths = (counts / max_count * max_display_length).astype(int) if max_count > 0 else np.zeros(len(counts), dtype=int)
+    return "".join(
+        f"<div style='font-family: monospace;'><span style='display: inline-block; width: 60px;'>{label}</span>"
+        f"<span style='color: {color};'>{'█' * length}</span> <span> ({count})</span></div>"
+        for label, length, count in zip(labels, bar_lengths, counts)
+    )
+
+def build_metric_cards_html(cards):
+    """生成一行核心指标卡片HTML（flex横向排列，五张卡片一次性渲染）；cards为(标题, 标题颜色, 背景色, 数值, 变化颜色, 变化文本)列表"""
+    cards_html = "".join(
+        f"<div style='flex: 1; background-color: {bg_color}; padding: 15px; border-radius: 8px; text-align: center;'>"
+        f"<h5 style='margin: 0; color: {title_color};'>{title}</h5>"
+        f"<p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{value}</p>"
+        f"<p style='font-size: 14px; color: {change_color}; margin: 0;'>{change_text}</p>"
+        "</div>"
+        for title, title_color, bg_color, value, change_color, change_text in cards
+    )
+    return f"<div style='display: flex; gap: 1rem;'>{cards_html}</div>"
+
+
+# 货代/仓库准时情况：当月数据只按（维度, 提前/延期）分组一次，柱状图计数、明细表和汇总表都由这张小表得到
+# 当月子表由月份唯一确定（参数加下划线不参与哈希），按月份+维度做缓存键
+@st.cache_data(show_spinner=False)
+def dimension_group_sums(_df_current, month, dim_col):
+    """返回按（维度, 提前/延期）分组的行数/订单个数/准时数及差值列的和与计数（保留状态为空的组）"""
+    value_cols = [col for col in ["预计物流时效-实际物流时效差值(绝对值)", "预计物流时效-实际物流时效差值"] if col in _df_current.columns]
+    # 先按组求和/计数，均值和准时率最后用和÷数得到；状态为空的订单不进明细表，但要计入“全部订单”的维度汇总
+    group_sums = _df_current.groupby([dim_col, "提前/延期"], dropna=False).agg(
+        行数=("是否准时", "size"),
+        订单个数=("FBA号", "count"),
+        准时数=("是否准时", "sum"),
+        **{f"{col}_和": (col, "sum") for col in value_cols},
+        **{f"{col}_数": (col, "count") for col in value_cols}
+    )
+    return group_sums[group_sums.index.get_level_values(dim_col).notna()]
+
+
+def dimension_tables(group_sums, dim_col, delay_filter):
+    """由分组小表得到（维度+准时状态明细表, 维度汇总表），订单范围筛选直接按状态取组"""
+    status = group_sums.index.get_level_values("提前/延期")
+    if delay_filter == "仅提前/准时":
+        group_sums = group_sums[status == "提前/准时"]
+    elif delay_filter == "仅延期":
+        group_sums = group_sums[status == "延期"]
+    value_cols = [col[:-2] for col in group_sums.columns if col.endswith("_和")]
+
+    # 明细（维度+准时状态）：去掉状态为空的组
+    detail_sums = group_sums[group_sums.index.get_level_values("提前/延期").notna()]
+    dim_detail = pd.DataFrame({
+        "订单个数": detail_sums["订单个数"],
+        "准时率": detail_sums["准时数"] / detail_sums["行数"],
+        **{f"{col}_均值": detail_sums[f"{col}_和"] / detail_sums[f"{col}_数"] for col in value_cols}
+    }).reset_index()
+
+    # 汇总（无准时状态维度）：在小表上按维度合计
+    summary_sums = group_sums.groupby(level=dim_col).sum()
+    dim_summary = pd.DataFrame({
+        "总订单个数": summary_sums["订单个数"],
+        "整体准时率": summary_sums["准时数"] / summary_sums["行数"],
+        **{f"{col}_整体均值": summary_sums[f"{col}_和"] / summary_sums[f"{col}_数"] for col in value_cols}
+    }).reset_index()
+    return dim_detail, dim_summary
+
+
+# ---------------------- 表格下载 ----------------------
+EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+@st.cache_data(show_spinner=False)
+def df_to_excel_bytes(df, sheet_name):
+    """将DataFrame导出为Excel文件的二进制内容（数据未变化时直接复用缓存，不重复序列化）"""
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return output.getvalue()
+
+
+# 数据源筛选：数据来自常驻缓存的load_data（参数加下划线不参与哈希），只按四个筛选值做缓存键，切换其他控件时直接复用结果
+@st.cache_data(show_spinner=False, max_entries=32)
+def filter_source_data(_df_air, month, warehouse, freight, status):
+    """按到货年月/仓库/货代/提前延期筛选数据源（“全部”表示不筛选）"""
+    # 只为实际生效的筛选条件生成掩码，合并后按行号一次取出子表
+    filter_masks = [
+        (_df_air[col] == val).to_numpy()
+        for col, val in [("到货年月", month), ("仓库", warehouse), ("货代", freight), ("提前/延期", status)]
+        if val != "全部" and col in _df_air.columns
+    ]
+    return _df_air.iloc[np.flatnonzero(np.logical_and.reduce(filter_masks))] if filter_masks else _df_air
+
+
+
 # ---------------------- 主页面构建 ----------------------
 st.title("📦 海运分析看板区域")
 st.divider()
@@ -124,7 +237,7 @@ st.divider()
 st.subheader("🔍 当月海运分析")
 
 # 时间筛选器（到货年月，最新的在最上方）
-month_options = sorted(df_air["到货年月"].unique(), reverse=True) if len(df_air["到货年月"].unique()) > 0 else []
+month_options = sorted(month_groups.keys(), reverse=True)
 selected_month = st.selectbox(
     "选择到货年月",
     options=month_options,
@@ -134,14 +247,10 @@ selected_month = st.selectbox(
 
 # 筛选当月数据
 if month_options and selected_month:
-    df_current = df_air[df_air["到货年月"] == selected_month].copy()
+    df_current = month_groups[selected_month]
     # 获取上月数据
     prev_month = get_prev_month(selected_month)
-    df_prev = df_air[
-        df_air["到货年月"] == prev_month].copy() if prev_month and prev_month in month_options else pd.DataFrame()
-
-    # ---------------------- ① 核心指标卡片 ----------------------
-    st.markdown("### 核心指标")
+    df_prev = month_groups.get(prev_month, pd.DataFrame())
 
     # ---------------------- ① 核心指标卡片 ----------------------
     st.markdown("### 核心指标")
@@ -154,88 +263,53 @@ if month_options and selected_month:
     fba_change_text = f"{'↑' if fba_change > 0 else '↓' if fba_change < 0 else '—'} {abs(fba_change)} (上月: {prev_fba})"
     fba_change_color = "red" if fba_change > 0 else "green" if fba_change < 0 else "gray"
 
+    # 提前/延期状态计数（当月、上月各统计一次，供提前/准时数和延期数共用）
+    current_status_counts = df_current["提前/延期"].value_counts() if "提前/延期" in df_current.columns else pd.Series(dtype="int64")
+    prev_status_counts = df_prev["提前/延期"].value_counts() if not df_prev.empty and "提前/延期" in df_prev.columns else pd.Series(dtype="int64")
+
     # 2. 提前/准时数
-    current_on_time = len(
-        df_current[df_current["提前/延期"] == "提前/准时"]) if "提前/延期" in df_current.columns else 0
-    prev_on_time = len(
-        df_prev[df_prev["提前/延期"] == "提前/准时"]) if not df_prev.empty and "提前/延期" in df_prev.columns else 0
+    current_on_time = int(current_status_counts.get("提前/准时", 0))
+    prev_on_time = int(prev_status_counts.get("提前/准时", 0))
     on_time_change = current_on_time - prev_on_time
     on_time_change_text = f"{'↑' if on_time_change > 0 else '↓' if on_time_change < 0 else '—'} {abs(on_time_change)} (上月: {prev_on_time})"
     on_time_change_color = "red" if on_time_change > 0 else "green" if on_time_change < 0 else "gray"
 
     # 3. 延期数
-    current_delay = len(df_current[df_current["提前/延期"] == "延期"]) if "提前/延期" in df_current.columns else 0
-    prev_delay = len(
-        df_prev[df_prev["提前/延期"] == "延期"]) if not df_prev.empty and "提前/延期" in df_prev.columns else 0
+    current_delay = int(current_status_counts.get("延期", 0))
+    prev_delay = int(prev_status_counts.get("延期", 0))
     delay_change = current_delay - prev_delay
     delay_change_text = f"{'↑' if delay_change > 0 else '↓' if delay_change < 0 else '—'} {abs(delay_change)} (上月: {prev_delay})"
     delay_change_color = "red" if delay_change > 0 else "green" if delay_change < 0 else "gray"
 
-    # 4. 绝对值差值平均值（将百分比改为差值）
+    # 时效差值均值（两列合并为一次均值计算，当月、上月各一次）
     abs_col = "预计物流时效-实际物流时效差值(绝对值)"
-    current_abs_avg = df_current[abs_col].mean() if abs_col in df_current.columns and len(df_current) > 0 else 0
-    prev_abs_avg = df_prev[abs_col].mean() if not df_prev.empty and abs_col in df_prev.columns and len(
-        df_prev) > 0 else 0
+    diff_col = "预计物流时效-实际物流时效差值"
+    mean_cols = [col for col in [abs_col, diff_col] if col in df_current.columns]
+    current_means = df_current[mean_cols].mean() if len(df_current) > 0 else pd.Series(dtype="float64")
+    prev_means = df_prev[mean_cols].mean() if not df_prev.empty else pd.Series(dtype="float64")
+
+    # 4. 绝对值差值平均值（将百分比改为差值）
+    current_abs_avg = current_means.get(abs_col, 0)
+    prev_abs_avg = prev_means.get(abs_col, 0)
     abs_change = current_abs_avg - prev_abs_avg  # 差值计算（替换百分比）
     abs_change_text = f"{'↑' if abs_change > 0 else '↓' if abs_change < 0 else '—'} {abs(abs_change):.2f} (上月: {prev_abs_avg:.2f})"
     abs_change_color = "red" if abs_change > 0 else "green" if abs_change < 0 else "gray"
 
     # 5. 实际差值平均值
-    diff_col = "预计物流时效-实际物流时效差值"
-    current_diff_avg = df_current[diff_col].mean() if diff_col in df_current.columns and len(df_current) > 0 else 0
-    prev_diff_avg = df_prev[diff_col].mean() if not df_prev.empty and diff_col in df_prev.columns and len(
-        df_prev) > 0 else 0
+    current_diff_avg = current_means.get(diff_col, 0)
+    prev_diff_avg = prev_means.get(diff_col, 0)
     diff_change = current_diff_avg - prev_diff_avg
     diff_change_text = f"{'↑' if diff_change > 0 else '↓' if diff_change < 0 else '—'} {abs(diff_change):.2f} (上月: {prev_diff_avg:.2f})"
     diff_change_color = "red" if diff_change > 0 else "green" if diff_change < 0 else "gray"
 
-    # 显示卡片（一行五列）- 改用HTML自定义样式
-    col1, col2, col3, col4, col5 = st.columns(5)
-
-    with col1:
-        st.markdown(f"""
-        <div style='background-color: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center;'>
-            <h5 style='margin: 0; color: #333;'>FBA单</h5>
-            <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_fba}</p>
-            <p style='font-size: 14px; color: {fba_change_color}; margin: 0;'>{fba_change_text}</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-    with col2:
-        st.markdown(f"""
-        <div style='background-color: #f0f8f0; padding: 15px; border-radius: 8px; text-align: center;'>
-            <h5 style='margin: 0; color: green;'>提前/准时数</h5>
-            <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_on_time}</p>
-            <p style='font-size: 14px; color: {on_time_change_color}; margin: 0;'>{on_time_change_text}</p>  <!-- 新增 -->
-        </div>
-        """, unsafe_allow_html=True)
-
-    with col3:
-        st.markdown(f"""
-        <div style='background-color: #fff0f0; padding: 15px; border-radius: 8px; text-align: center;'>
-            <h5 style='margin: 0; color: red;'>延期数</h5>
-            <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_delay}</p>
-            <p style='font-size: 14px; color: {delay_change_color}; margin: 0;'>{delay_change_text}</p>  <!-- 新增 -->
-        </div>
-        """, unsafe_allow_html=True)
-
-    with col4:
-        st.markdown(f"""
-        <div style='background-color: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center;'>
-            <h5 style='margin: 0; color: #333;'>绝对值差值均值</h5>
-            <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_abs_avg:.2f}</p>
-            <p style='font-size: 14px; color: {abs_change_color}; margin: 0;'>{abs_change_text}</p>
-        </div>
-        """, unsafe_allow_html=True)
-
-    with col5:
-        st.markdown(f"""
-        <div style='background-color: #f8f9fa; padding: 15px; border-radius: 8px; text-align: center;'>
-            <h5 style='margin: 0; color: #333;'>实际差值均值</h5>
-            <p style='font-size: 24px; margin: 8px 0; font-weight: bold;'>{current_diff_avg:.2f}</p>
-            <p style='font-size: 14px; color: {diff_change_color}; margin: 0;'>{diff_change_text}</p>
-        </div>
-        """, unsafe_allow_html=True)
+    # 显示卡片（一行五列，flex横向排列，一次渲染）- 改用HTML自定义样式
+    st.markdown(build_metric_cards_html([
+        ("FBA单", "#333", "#f8f9fa", current_fba, fba_change_color, fba_change_text),
+        ("提前/准时数", "green", "#f0f8f0", current_on_time, on_time_change_color, on_time_change_text),
+        ("延期数", "red", "#fff0f0", current_delay, delay_change_color, delay_change_text),
+        ("绝对值差值均值", "#333", "#f8f9fa", f"{current_abs_avg:.2f}", abs_change_color, abs_change_text),
+        ("实际差值均值", "#333", "#f8f9fa", f"{current_diff_avg:.2f}", diff_change_color, diff_change_text)
+    ]), unsafe_allow_html=True)
 
     # 生成总结文字
     summary_text = f"""
@@ -317,31 +391,23 @@ if month_options and selected_month:
             # 生成文本直方图（使用HTML设置颜色，与饼图保持一致）
             st.markdown("#### 提前/准时区间分布")
             if not early_counts.empty:
-                for day, count in early_counts.items():
-                    # 计算显示长度（按比例缩放）
-                    display_length = int((count / max_count) * max_display_length) if max_count > 0 else 0
-                    bar = "█" * display_length
-                    day_label = f"+{day}天" if day > 0 else "0天"  # 0天特殊处理
-                    # 绿色显示（与饼图提前/准时颜色一致）
-                    st.markdown(
-                        f"<div style='font-family: monospace;'><span style='display: inline-block; width: 60px;'>{day_label}</span>"
-                        f"<span style='color: green;'>{bar}</span> <span> ({count})</span></div>",
-                        unsafe_allow_html=True
-                    )
+                day_labels = [f"+{day}天" if day > 0 else "0天" for day in early_counts.index]  # 0天特殊处理
+                # 绿色显示（与饼图提前/准时颜色一致），整张直方图一次性渲染
+                st.markdown(
+                    build_text_histogram_html(day_labels, early_counts, max_count, "green", max_display_length),
+                    unsafe_allow_html=True
+                )
             else:
                 st.text("暂无提前/准时数据")
 
             st.markdown("#### 延迟区间分布")
             if not delay_counts.empty:
-                for day, count in delay_counts.items():
-                    display_length = int((count / max_count) * max_display_length) if max_count > 0 else 0
-                    bar = "█" * display_length
-                    # 红色显示（与饼图延期颜色一致）
-                    st.markdown(
-                        f"<div style='font-family: monospace;'><span style='display: inline-block; width: 60px;'>{day}天</span>"
-                        f"<span style='color: red;'>{bar}</span> <span> ({count})</span></div>",
-                        unsafe_allow_html=True
-                    )
+                day_labels = [f"{day}天" for day in delay_counts.index]
+                # 红色显示（与饼图延期颜色一致）
+                st.markdown(
+                    build_text_histogram_html(day_labels, delay_counts, max_count, "red", max_display_length),
+                    unsafe_allow_html=True
+                )
             else:
                 st.text("暂无延迟数据")
         else:
@@ -386,9 +452,12 @@ if month_options and selected_month:
         # 过滤存在的整数列
         int_cols = [col for col in int_cols if col in df_detail.columns]
 
-        # 将整数列转换为无小数点格式（空值填充为0）
-        for col in int_cols:
-            df_detail[col] = pd.to_numeric(df_detail[col], errors='coerce').fillna(0).astype(int)
+        # 将整数列整块转换为无小数点格式（空值填充为0）：一次二维转换，不再逐列生成新Series
+        if int_cols:
+            df_detail[int_cols] = (
+                df_detail[int_cols].apply(pd.to_numeric, errors='coerce').fillna(0)
+                .to_numpy(dtype="float64").astype("int32")
+            )
 
         # 计算平均值行
         avg_row = {}
@@ -540,37 +609,17 @@ if month_options and selected_month:
         st.markdown(html_content, unsafe_allow_html=True)
 
         # === 3. 添加表格下载功能 ===
-        import pandas as pd
-        from io import BytesIO
-        import base64
-
         # 构建带平均值的完整数据（用于下载）
         df_download = pd.concat([pd.DataFrame([avg_row]), df_detail], ignore_index=True)
 
-
-        # 定义下载函数
-        def get_table_download_link(df, filename, text):
-            """生成表格下载链接"""
-            # 保存为Excel（保留格式）
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False, sheet_name='海运明细')
-            output.seek(0)
-            b64 = base64.b64encode(output.read()).decode()
-
-            # 生成下载链接
-            href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">{text}</a>'
-            return href
-
-
-        # 显示下载按钮
-        st.markdown(
-            get_table_download_link(
-                df_download,
-                f"海运明细_{selected_month}.xlsx",
-                "📥 下载海运明细表格（Excel格式）"
-            ),
-            unsafe_allow_html=True
+        # 显示下载按钮（文件内容按需由浏览器下载，不再以base64内嵌到页面；点击下载不触发重跑）
+        st.download_button(
+            "📥 下载海运明细表格（Excel格式）",
+            data=df_to_excel_bytes(df_download, "海运明细"),
+            file_name=f"海运明细_{selected_month}.xlsx",
+            mime=EXCEL_MIME,
+            on_click="ignore",
+            key="detail_download"
         )
 
     else:
@@ -587,8 +636,9 @@ if month_options and selected_month:
 
         # 左：货代准时情况柱状图（保留原有逻辑）
         with col1:
-            # 按货代统计提前/准时和延期数量
-            freight_data = df_current.groupby(["货代", "提前/延期"]).size().unstack(fill_value=0)
+            # 按货代统计提前/准时和延期数量（当月按货代+状态分组一次，右侧表格复用同一张小表）
+            freight_sums = dimension_group_sums(df_current, selected_month, "货代")
+            freight_data = freight_sums.loc[freight_sums.index.get_level_values("提前/延期").notna(), "行数"].unstack(fill_value=0)
             if "提前/准时" not in freight_data.columns:
                 freight_data["提前/准时"] = 0
             if "延期" not in freight_data.columns:
@@ -614,55 +664,29 @@ if month_options and selected_month:
                 key="freight_table_filter"
             )
 
-            # 2. 根据筛选条件过滤数据
-            if delay_filter == "仅提前/准时":
-                df_filtered = df_current[df_current["提前/延期"] == "提前/准时"].copy()
-            elif delay_filter == "仅延期":
-                df_filtered = df_current[df_current["提前/延期"] == "延期"].copy()
-            else:
-                df_filtered = df_current.copy()
-
-            # 3. 定义需要计算的差值列
+            # 2. 定义需要计算的差值列
             abs_diff_col = "预计物流时效-实际物流时效差值(绝对值)"
             diff_col = "预计物流时效-实际物流时效差值"
 
-            # 4. 核心：双层聚合（支持「货代」+「提前/延期」维度）
-            # 4.1 基础聚合（货代+准时状态）
-            freight_detail = df_filtered.groupby(["货代", "提前/延期"]).agg(
-                订单个数=("FBA号", "count"),  # 新增个数列
-                准时率=("提前/延期", lambda x: (x == "提前/准时").sum() / len(x) if len(x) > 0 else 0),
-                **{
-                    f"{abs_diff_col}_均值": (abs_diff_col, "mean") if abs_diff_col in df_filtered.columns else 0,
-                    f"{diff_col}_均值": (diff_col, "mean") if diff_col in df_filtered.columns else 0
-                }
-            ).reset_index()
-
-            # 4.2 货代汇总聚合（无准时状态维度，用于对比）
-            freight_summary = df_filtered.groupby("货代").agg(
-                总订单个数=("FBA号", "count"),
-                整体准时率=("提前/延期", lambda x: (x == "提前/准时").sum() / len(x) if len(x) > 0 else 0),
-                **{
-                    f"{abs_diff_col}_整体均值": (abs_diff_col, "mean") if abs_diff_col in df_filtered.columns else 0,
-                    f"{diff_col}_整体均值": (diff_col, "mean") if diff_col in df_filtered.columns else 0
-                }
-            ).reset_index()
-
-            # 5. 数值格式化
-            # 5.1 明细表格格式化
+            # 3. 核心：由当月分组小表得到明细表（货代+准时状态）和汇总表（货代），订单范围筛选直接作用在小表上
+            freight_detail, freight_summary = dimension_tables(freight_sums, "货代", delay_filter)
+
+            # 4. 数值格式化
+            # 4.1 明细表格格式化
             freight_detail["准时率"] = freight_detail["准时率"].apply(lambda x: f"{x:.2%}")
             if abs_diff_col in freight_detail.columns:
                 freight_detail[f"{abs_diff_col}_均值"] = freight_detail[f"{abs_diff_col}_均值"].round(2)
             if diff_col in freight_detail.columns:
                 freight_detail[f"{diff_col}_均值"] = freight_detail[f"{diff_col}_均值"].round(2)
 
-            # 5.2 汇总表格格式化
+            # 4.2 汇总表格格式化
             freight_summary["整体准时率"] = freight_summary["整体准时率"].apply(lambda x: f"{x:.2%}")
             if abs_diff_col in freight_summary.columns:
                 freight_summary[f"{abs_diff_col}_整体均值"] = freight_summary[f"{abs_diff_col}_整体均值"].round(2)
             if diff_col in freight_summary.columns:
                 freight_summary[f"{diff_col}_整体均值"] = freight_summary[f"{diff_col}_整体均值"].round(2)
 
-            # 6. 切换显示模式（汇总/明细）
+            # 5. 切换显示模式（汇总/明细）
             view_mode = st.radio(
                 "表格显示模式",
                 options=["货代汇总（无状态）", "货代+准时状态（明细）"],
@@ -670,7 +694,7 @@ if month_options and selected_month:
                 key="freight_view_mode"
             )
 
-            # 7. 显示对应表格
+            # 6. 显示对应表格
             st.markdown(f"#### {view_mode}")
             if view_mode == "货代汇总（无状态）":
                 # 汇总表格（不加提前/准时/延期维度）
@@ -702,27 +726,17 @@ if month_options and selected_month:
                     height=350
                 )
 
-            # 8. 下载功能
-            import pandas as pd
-            from io import BytesIO
-            import base64
-
-
-            def generate_download_link(df, filename, link_text):
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df.to_excel(writer, index=False, sheet_name='货代分析')
-                output.seek(0)
-                b64 = base64.b64encode(output.read()).decode()
-                return f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">{link_text}</a>'
-
-
+            # 7. 下载功能
             # 下载当前显示的表格数据
             download_df = freight_summary if view_mode == "货代汇总（无状态）" else freight_detail
             download_filename = f"货代分析_{selected_month}_{view_mode.replace('（', '').replace('）', '').replace(' ', '')}.xlsx"
-            st.markdown(
-                generate_download_link(download_df, download_filename, "📥 下载当前表格数据"),
-                unsafe_allow_html=True
+            st.download_button(
+                "📥 下载当前表格数据",
+                data=df_to_excel_bytes(download_df, "货代分析"),
+                file_name=download_filename,
+                mime=EXCEL_MIME,
+                on_click="ignore",
+                key="freight_download"
             )
     else:
         st.write("⚠️ 暂无货代准时情况数据")
@@ -738,8 +752,9 @@ if month_options and selected_month:
 
         # 左：仓库准时情况柱状图（复用货代图表逻辑，替换为仓库维度）
         with col1:
-            # 按仓库统计提前/准时和延期数量
-            warehouse_data = df_current.groupby(["仓库", "提前/延期"]).size().unstack(fill_value=0)
+            # 按仓库统计提前/准时和延期数量（当月按仓库+状态分组一次，右侧表格复用同一张小表）
+            warehouse_sums = dimension_group_sums(df_current, selected_month, "仓库")
+            warehouse_data = warehouse_sums.loc[warehouse_sums.index.get_level_values("提前/延期").notna(), "行数"].unstack(fill_value=0)
             if "提前/准时" not in warehouse_data.columns:
                 warehouse_data["提前/准时"] = 0
             if "延期" not in warehouse_data.columns:
@@ -765,55 +780,29 @@ if month_options and selected_month:
                 key="warehouse_table_filter"
             )
 
-            # 2. 根据筛选条件过滤数据
-            if delay_filter == "仅提前/准时":
-                df_filtered = df_current[df_current["提前/延期"] == "提前/准时"].copy()
-            elif delay_filter == "仅延期":
-                df_filtered = df_current[df_current["提前/延期"] == "延期"].copy()
-            else:
-                df_filtered = df_current.copy()
-
-            # 3. 定义需要计算的差值列
+            # 2. 定义需要计算的差值列
             abs_diff_col = "预计物流时效-实际物流时效差值(绝对值)"
             diff_col = "预计物流时效-实际物流时效差值"
 
-            # 4. 核心：双层聚合（支持「仓库」+「提前/延期」维度）
-            # 4.1 基础聚合（仓库+准时状态）
-            warehouse_detail = df_filtered.groupby(["仓库", "提前/延期"]).agg(
-                订单个数=("FBA号", "count"),  # 新增个数列
-                准时率=("提前/延期", lambda x: (x == "提前/准时").sum() / len(x) if len(x) > 0 else 0),
-                **{
-                    f"{abs_diff_col}_均值": (abs_diff_col, "mean") if abs_diff_col in df_filtered.columns else 0,
-                    f"{diff_col}_均值": (diff_col, "mean") if diff_col in df_filtered.columns else 0
-                }
-            ).reset_index()
-
-            # 4.2 仓库汇总聚合（无准时状态维度，用于对比）
-            warehouse_summary = df_filtered.groupby("仓库").agg(
-                总订单个数=("FBA号", "count"),
-                整体准时率=("提前/延期", lambda x: (x == "提前/准时").sum() / len(x) if len(x) > 0 else 0),
-                **{
-                    f"{abs_diff_col}_整体均值": (abs_diff_col, "mean") if abs_diff_col in df_filtered.columns else 0,
-                    f"{diff_col}_整体均值": (diff_col, "mean") if diff_col in df_filtered.columns else 0
-                }
-            ).reset_index()
-
-            # 5. 数值格式化
-            # 5.1 明细表格格式化
+            # 3. 核心：由当月分组小表得到明细表（仓库+准时状态）和汇总表（仓库），订单范围筛选直接作用在小表上
+            warehouse_detail, warehouse_summary = dimension_tables(warehouse_sums, "仓库", delay_filter)
+
+            # 4. 数值格式化
+            # 4.1 明细表格格式化
             warehouse_detail["准时率"] = warehouse_detail["准时率"].apply(lambda x: f"{x:.2%}")
             if abs_diff_col in warehouse_detail.columns:
                 warehouse_detail[f"{abs_diff_col}_均值"] = warehouse_detail[f"{abs_diff_col}_均值"].round(2)
             if diff_col in warehouse_detail.columns:
                 warehouse_detail[f"{diff_col}_均值"] = warehouse_detail[f"{diff_col}_均值"].round(2)
 
-            # 5.2 汇总表格格式化
+            # 4.2 汇总表格格式化
             warehouse_summary["整体准时率"] = warehouse_summary["整体准时率"].apply(lambda x: f"{x:.2%}")
             if abs_diff_col in warehouse_summary.columns:
                 warehouse_summary[f"{abs_diff_col}_整体均值"] = warehouse_summary[f"{abs_diff_col}_整体均值"].round(2)
             if diff_col in warehouse_summary.columns:
                 warehouse_summary[f"{diff_col}_整体均值"] = warehouse_summary[f"{diff_col}_整体均值"].round(2)
 
-            # 6. 切换显示模式（汇总/明细）
+            # 5. 切换显示模式（汇总/明细）
             view_mode = st.radio(
                 "表格显示模式",
                 options=["仓库汇总（无状态）", "仓库+准时状态（明细）"],
@@ -821,7 +810,7 @@ if month_options and selected_month:
                 key="warehouse_view_mode"
             )
 
-            # 7. 显示对应表格
+            # 6. 显示对应表格
             st.markdown(f"#### {view_mode}")
             if view_mode == "仓库汇总（无状态）":
                 # 汇总表格（不加提前/准时/延期维度）
@@ -853,27 +842,17 @@ if month_options and selected_month:
                     height=350
                 )
 
-            # 8. 下载功能
-            import pandas as pd
-            from io import BytesIO
-            import base64
-
-
-            def generate_download_link(df, filename, link_text):
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    df.to_excel(writer, index=False, sheet_name='仓库分析')
-                output.seek(0)
-                b64 = base64.b64encode(output.read()).decode()
-                return f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">{link_text}</a>'
-
-
+            # 7. 下载功能
             # 下载当前显示的表格数据
             download_df = warehouse_summary if view_mode == "仓库汇总（无状态）" else warehouse_detail
             download_filename = f"仓库分析_{selected_month}_{view_mode.replace('（', '').replace('）', '').replace(' ', '')}.xlsx"
-            st.markdown(
-                generate_download_link(download_df, download_filename, "📥 下载当前表格数据"),
-                unsafe_allow_html=True
+            st.download_button(
+                "📥 下载当前表格数据",
+                data=df_to_excel_bytes(download_df, "仓库分析"),
+                file_name=download_filename,
+                mime=EXCEL_MIME,
+                on_click="ignore",
+                key="warehouse_download"
             )
     else:
         st.write("⚠️ 暂无仓库准时情况数据")
@@ -923,7 +902,8 @@ if month_options and selected_month:
             with col1:
                 # 1. 基础筛选控件
                 st.markdown("#### 分析条件设置")
-                all_months_trend = sorted(df_air[COL_DELIVERY_MONTH].dropna().unique())
+                # 复用当月分析已排好序的月份列表（倒序转为正序），不再对全表去重排序
+                all_months_trend = month_options[::-1]
 
                 # 月份范围选择
                 if len(all_months_trend) >= 2:
@@ -1004,21 +984,21 @@ if month_options and selected_month:
                     df_trend_filtered = df_air[
                         (df_air[COL_DELIVERY_MONTH].apply(month_to_num) >= month_to_num(start_month)) &
                         (df_air[COL_DELIVERY_MONTH].apply(month_to_num) <= month_to_num(end_month))
-                        ].copy()
+                        ]
 
                     # 订单状态筛选
                     if delay_filter == "仅提前/准时":
-                        df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_DELAY_STATUS] == "提前/准时"].copy()
+                        df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_DELAY_STATUS] == "提前/准时"]
                     elif delay_filter == "仅延期":
-                        df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_DELAY_STATUS] == "延期"].copy()
+                        df_trend_filtered = df_trend_filtered[df_trend_filtered[COL_DELAY_STATUS] == "延期"]
 
                     # 适配单选筛选逻辑：仅当选择了具体货代/仓库时才过滤
                     if analysis_dimension == "货代维度" and selected_dimension is not None:
                         df_trend_filtered = df_trend_filtered[
-                            df_trend_filtered[COL_FREIGHT] == selected_dimension].copy()
+                            df_trend_filtered[COL_FREIGHT] == selected_dimension]
                     elif analysis_dimension == "仓库维度" and selected_dimension is not None:
                         df_trend_filtered = df_trend_filtered[
-                            df_trend_filtered[COL_WAREHOUSE] == selected_dimension].copy()
+                            df_trend_filtered[COL_WAREHOUSE] == selected_dimension]
 
                     # 3. 重写数据聚合逻辑（核心修复：分步聚合+手动命名）
                     trend_data = pd.DataFrame()
@@ -1044,17 +1024,8 @@ if month_options and selected_month:
                                 df_count = df_trend_filtered.groupby(group_cols).size().reset_index(name="订单个数")
 
                             # ========== 步骤2：计算准时率 ==========
-                            # 先计算每组的准时订单数和总订单数
-                            df_delay = df_trend_filtered.copy()
-                            df_delay["是否准时"] = df_delay[COL_DELAY_STATUS] == "提前/准时"
-                            df_rate = df_delay.groupby(group_cols).agg({
-                                "是否准时": ["sum", "count"]
-                            }).reset_index()
-                            df_rate.columns = group_cols + ["准时订单数", "总订单数"]
-                            # 计算准时率（避免除零）
-                            df_rate["准时率"] = df_rate["准时订单数"] / df_rate["总订单数"].replace(0, 1)
-                            # 只保留分组列和准时率
-                            df_rate = df_rate[group_cols + ["准时率"]]
+                            # 准时标记列已在load_data中算好（1=提前/准时），每组均值即准时率，无需复制整表再逐组计数
+                            df_rate = df_trend_filtered.groupby(group_cols)["是否准时"].mean().reset_index(name="准时率")
 
                             # ========== 步骤3：计算差值列均值（仅当列存在时） ==========
                             df_diff = pd.DataFrame()
@@ -1324,21 +1295,16 @@ if month_options and selected_month:
 
 
                         # 9. 下载功能
-                        def generate_trend_download_link(df, filename, link_text):
-                            output = BytesIO()
-                            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                                df.to_excel(writer, index=False, sheet_name=f'{analysis_dimension}趋势')
-                            output.seek(0)
-                            b64 = base64.b64encode(output.read()).decode()
-                            return f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">{link_text}</a>'
-
-
                         # 下载文件名补充筛选条件
                         download_suffix = f"_{selected_dimension}" if selected_dimension else ""
                         download_filename = f"{analysis_dimension}_月份海运趋势{download_suffix}_{start_month}_{end_month}.xlsx"
-                        st.markdown(
-                            generate_trend_download_link(df_with_avg, download_filename, "📥 下载趋势数据（含平均值）"),
-                            unsafe_allow_html=True
+                        st.download_button(
+                            "📥 下载趋势数据（含平均值）",
+                            data=df_to_excel_bytes(df_with_avg, f"{analysis_dimension}趋势"),
+                            file_name=download_filename,
+                            mime=EXCEL_MIME,
+                            on_click="ignore",
+                            key="trend_download"
                         )
                     else:
                         st.write("⚠️ 筛选后无数据")
@@ -1584,8 +1550,7 @@ if month_options and selected_month:
 
     # 1. 到货年月筛选器（单选+默认“全部”）
     with col1:
-        month_unique = df_air["到货年月"].dropna().unique()
-        month_options_filter = ["全部"] + sorted(month_unique, reverse=True) if len(month_unique) > 0 else ["全部"]
+        month_options_filter = ["全部"] + month_options
         selected_month_filter = st.selectbox(
             "到货年月",
             options=month_options_filter,
@@ -1636,16 +1601,10 @@ if month_options and selected_month:
         )
 
     # ---------------------- 应用筛选逻辑 ----------------------
-    filter_conditions = pd.Series([True] * len(df_air))
-    if selected_month_filter != "全部" and len(df_air) > 0:
-        filter_conditions = filter_conditions & (df_air["到货年月"] == selected_month_filter)
-    if "仓库" in df_air.columns and selected_warehouse_filter != "全部" and len(df_air) > 0:
-        filter_conditions = filter_conditions & (df_air["仓库"] == selected_warehouse_filter)
-    if "货代" in df_air.columns and selected_freight_filter != "全部" and len(df_air) > 0:
-        filter_conditions = filter_conditions & (df_air["货代"] == selected_freight_filter)
-    if "提前/延期" in df_air.columns and selected_status_filter != "全部" and len(df_air) > 0:
-        filter_conditions = filter_conditions & (df_air["提前/延期"] == selected_status_filter)
-    df_filtered = df_air[filter_conditions].copy()
+    # 筛选结果按四个筛选值缓存（下面只读取，不修改）
+    df_filtered = filter_source_data(
+        df_air, selected_month_filter, selected_warehouse_filter, selected_freight_filter, selected_status_filter
+    )
 
     # ---------------------- 计算平均值 ----------------------
     avg_target_cols = [
@@ -1669,7 +1628,7 @@ if month_options and selected_month:
         for col in avg_target_cols:
             if col in display_cols:
                 numeric_vals = pd.to_numeric(df_filtered[col], errors='coerce').dropna()
-                avg_row[col] = round(numeric_vals.mean(), 2) if len(numeric_vals) > 0 else 0.00
+                avg_row[col] = round(float(numeric_vals.mean()), 2) if len(numeric_vals) > 0 else 0.00
 
     # 处理数据行
     df_display = df_filtered[display_cols].copy() if len(df_filtered) > 0 else pd.DataFrame(columns=display_cols)